@@ -22,7 +22,7 @@ from guidata.qt.QtGui import (QMainWindow, QMessageBox,
                               QVBoxLayout, QGridLayout,  
                               QTabWidget, QLabel, QLineEdit,  
                               QFont, QIcon)
-from guidata.qt.QtCore import (Qt, Signal, QThread, QLocale)
+from guidata.qt.QtCore import (Qt, Signal, QLocale)
 from guidata.qt import PYQT5
 #from guidata.qt.compat import getopenfilenames, getsavefilename
 #from guiqwt.signals import SIG_MARKER_CHANGED
@@ -32,7 +32,6 @@ import sys
 import os.path as osp
 import os
 import numpy as np
-import time
 
 #from guidata.dataset.datatypes import DataSet, ValueProp
 #from guidata.dataset.dataitems import (IntItem, FloatArrayItem, StringItem,
@@ -50,7 +49,8 @@ from guiqwt.config import _
 
 # local imports
 from Helpers.plotSignal import SignalFT, DockablePlotWidget
-from Helpers.genericthread import GenericWorker
+from Helpers.scheduler import Scheduler
+from Helpers.timebase import timeBase
 from Instruments.tiepie import TiePieUi
 from Instruments.pistage import PiStageUi, c0, fsDelay
 
@@ -241,8 +241,7 @@ class MainWindow(QMainWindow):
         QMainWindow.__init__(self)
 
         self.stage = None
-        self.stopOsci = False
-        self.stopMeasure = False
+        self.scanTimes = None # time stamps of last scan
         
         self.setWindowTitle(APP_NAME)
 
@@ -342,18 +341,9 @@ class MainWindow(QMainWindow):
             self.fdSignal.updatePlot(self.fdSignal.computeFFT(data)))
         
         ################
-        # create threads
-        #self.osciThr = GenericThread(self.getOsciData)
-        self.osciThr = QThread()
-        self.osciThr.start()
-        self.osciWorker = GenericWorker(self.getOsciData)
-        self.osciWorker.moveToThread(self.osciThr)
-        
-        #self.measureThr = GenericThread(self.getMeasureData)
-        self.measureThr = QThread()
-        self.measureThr.start()
-        self.measureWorker = GenericWorker(self.getMeasureData)
-        self.measureWorker.moveToThread(self.measureThr)        
+        # osci live view and scan both use the osci, they run in one lane
+        # of the scheduler, so starting one cancels the other
+        self.scheduler = Scheduler()
         
         ################
         # File menu
@@ -422,6 +412,8 @@ class MainWindow(QMainWindow):
 
         
     def closeEvent(self, event):
+        self.scheduler.close()
+        self.piUi.closeEvent(event)
         if self.stage is not None:
             self.stage.CloseConnection()
         if self.console is not None:
@@ -444,6 +436,9 @@ class MainWindow(QMainWindow):
             dataTd[:,2*i] = x
             dataTd[:,2*i+1] = y
         np.savetxt('data/{:s}_TD.txt'.format(now), dataTd, header=header)
+        if self.scanTimes is not None:
+            np.savetxt('data/{:s}_TD_time.txt'.format(now), self.scanTimes,
+                       fmt='%d', header='time of delay points, ns since epoch (UTC)')
         self.tdSignal.plot.save_widget('data/{:s}_TD.png'.format(now))
         
         # save frequency domain
@@ -473,25 +468,19 @@ class MainWindow(QMainWindow):
     #    print(self.stage.qPOS())
 
     def startOsciThr(self):
-        self.stopOsci = False
-        #self.osciThr.start()
-        self.osciWorker.start.emit()
+        self.scheduler.submit(self.getOsciData, lane='osci',
+                              cancelRunning=True)
     def stopOsciThr(self):
-        self.stopOsci = True
-        # TODO: not quite shure how to do this with the worker solution.
-        # finished signal is emitted but this function should wait for worker to finish?!?
-        while(self.osciWorker.isRunning()):
-            time.sleep(0.03)
-    def getOsciData(self):
-        while not self.stopOsci:
-            data = self.tiepieUi.getData()
+        self.scheduler.cancel('osci')
+    def getOsciData(self, token):
+        while not token.cancelled():
+            data = self.tiepieUi.getData(token)
+            if data is None:
+                break
             self.updateOsciPlot.emit(data)
-            time.sleep(0.5)
+            token.wait(0.5)
 
     def startMeasureThr(self):
-        # stop osci thread and start measure thread
-        self.stopOsciThr()
-        
         # rescale tdPlot (updateXAxe)
         self.piUi._xAxeChanged()
 
@@ -505,21 +494,30 @@ class MainWindow(QMainWindow):
         fdAxe = self.fdSignal.computeFFT(data)
         self.fdSignal.updateXAxe(fdAxe[0,0], fdAxe[-1,0])
 
-        self.stopMeasure = False
-        #self.measureThr.start()
-        self.measureWorker.start.emit()
+        # cancels the osci live view, scan starts as soon as it returned
+        self.scheduler.submit(self.getMeasureData, lane='osci',
+                              cancelRunning=True, onDone=self.__scanFinished)
     def stopMeasureThr(self):
-        self.stopMeasure = True
-        while(self.measureWorker.isRunning()):
-            time.sleep(0.03)
         self.startOsciThr()
-    def getMeasureData(self):
+    def __scanFinished(self, task):
+        '''
+        Live view continues after a complete scan
+        '''
+        if task.state == 'done':
+            self.startOsciThr()
+    def getMeasureData(self, token):
         delays = self.piUi.getDelays_fs()
         data = np.column_stack((delays, np.zeros(len(delays))))
+        # time of every delay point in ns since epoch, 0 if not measured
+        self.scanTimes = np.zeros(len(delays), dtype=np.int64)
         for i, delay in enumerate(delays):
-            if not self.stopMeasure:
-                self.piUi.gotoPos_fs(delay)
-                tmp = self.tiepieUi.getData()
+            if not token.cancelled():
+                if not self.piUi.gotoPos_fs(delay, token):
+                    break
+                tmp = self.tiepieUi.getData(token)
+                if tmp is None:
+                    break
+                self.scanTimes[i] = timeBase.nanoseconds()
                 self.updateOsciPlot.emit(tmp)
                 #print('measuring at', delay)
                 #y = dummyPulse(delay)
@@ -531,7 +529,6 @@ class MainWindow(QMainWindow):
                 self.updateFdPlot.emit(data)
             else:
                 break
-        self.startOsciThr()
     """
     def _newCenter(self):
         '''Function call when 'Center Here' triggered'''
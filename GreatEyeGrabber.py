@@ -12,7 +12,7 @@ from guidata.qt.QtGui import (QMainWindow, QMessageBox,
                               QSpinBox, QHBoxLayout,
                               QVBoxLayout, QGridLayout,  
                               QTabWidget, QLabel, QLineEdit,  
-                              QFont, QIcon)
+                              QFont, QIcon, QFileDialog)
 from guidata.qt.QtCore import (Qt, Signal, QThread, QLocale, QDir)
 from guidata.qt import PYQT5
 #from guidata.qt.compat import getopenfilenames, getsavefilename
@@ -41,10 +41,18 @@ from guiqwt.plot import CurveWidget, ImageWidget
 from guiqwt.config import _
 
 # local imports
-from scipy.io import savemat
+from Helpers.calibration import SpectrometerCalibration
+from Helpers.framecorrection import FrameCorrection
+from Helpers.framestats import FrameStatistics
+from Helpers.framewriter import FrameWriter
+from Helpers.lineout import LineOut, Waterfall
+from Helpers.peaktracker import PeakTracker
+from Helpers.spikefilter import SpikeFilter
+from Helpers.timebase import toIso, toSeconds, toDatetime
 from Helpers.plotSignal import SignalFT, ImageFT, DockablePlotWidget
 from Helpers.genericthread import GenericWorker
 from Instruments.greatEyes import GreatEyesUi
+from Instruments.greatEyesSdk import loadSdk, GreatEyesError
 
 # set default language to c, so decimal point is '.' not ',' on german systems
 QLocale.setDefault(QLocale.c())
@@ -111,12 +119,21 @@ class SiftProxy(object):
 class MainWindow(QMainWindow):
     updateCameraPlot = Signal(object)
     updateLineOutPlot = Signal(object)
-    def __init__(self):
+    def __init__(self, addr=0, sdk=None, numCameras=1):
         QMainWindow.__init__(self)
 
+        self.addr = addr # camera address, one window per camera
+        self.numCameras = numCameras
         self.stopAcqui = False
+        self.lastPng = 0 # time of last png snapshot (monotonic)
+        self.peaksShown = 0 # time of last peak plot update (monotonic)
+        self.maxPeakPoints = 2000 # plotted per peak, history is decimated
+        self.frameWidth = 2048 # pixels in x of current frames
         
-        self.setWindowTitle(APP_NAME)
+        self.setWindowTitle(APP_NAME if numCameras == 1 else
+                            APP_NAME + ' - camera {:d}'.format(addr))
+        # every spectrometer has its own calibration and master frames
+        camSuffix = '' if addr == 0 else '_cam{:d}'.format(addr)
 
         ##############
         # Camera image
@@ -128,16 +145,40 @@ class MainWindow(QMainWindow):
         self.image1.addHCursor(1)
         self.image1.addRoi(0, 1, 2048, 1)
         #self.image1.setup(self.image_toolbar)
+
+        ###############
+        # waterfall of lineouts
+        self.waterfallWidget = DockablePlotWidget(self, ImageWidget,
+                                              imagevis_toolbar)
+        self.waterfallImage = ImageFT(self, self.waterfallWidget.get_plot())
+        self.waterfall = Waterfall()
         
         ###############
         # camera line out
         curveplot_toolbar = self.addToolBar(_("Curve Plotting Toolbar"))
         self.curveWidget1 = DockablePlotWidget(self, CurveWidget,
                                               curveplot_toolbar)
+        self.calibration = SpectrometerCalibration(
+                'calibration' + camSuffix + '.json')
         self.curveWidget1.calcFun.addFun('Pixels', lambda x: x,
                                               lambda x: x)
+        self.curveWidget1.calcFun.addFun('eV', self.calibration.toEnergy,
+                                               self.calibration.toPixel)
+        self.curveWidget1.calcFun.addFun('nm', self.calibration.toWavelength,
+                                               self.calibration.fromWavelength)
         plot1 = self.curveWidget1.get_plot()
         self.signal1 = SignalFT(self, plot=plot1)
+        self.lineOut = LineOut()
+        self.correction = FrameCorrection('masters' + camSuffix)
+        self.spikeFilter = SpikeFilter()
+        self.statistics = FrameStatistics()
+
+        ###############
+        # peak positions, widths and intensities over time
+        self.peakWidget = DockablePlotWidget(self, CurveWidget,
+                                             curveplot_toolbar)
+        self.peakTracker = PeakTracker()
+        self.peakSignals = [] # one curve per peak window
         
 
         ##############
@@ -147,7 +188,7 @@ class MainWindow(QMainWindow):
         # widgets
         self.tabwidget = DockableTabWidget(self)
         #self.tabwidget.setMaximumWidth(500)
-        self.greateyesUi = GreatEyesUi(self)
+        self.greateyesUi = GreatEyesUi(self, addr, sdk)
         self.tabwidget.addTab(self.greateyesUi, 
                 QIcon('icons/Handyscope_HS4.png'), _("greateyes"))
         #self.fileUi = FileUi(self)
@@ -158,6 +199,10 @@ class MainWindow(QMainWindow):
                                               title=_("Camera"))
         self.dock2 = self.add_dockwidget(self.curveWidget1,
                                               title=_("Lineout"))
+        self.dock3 = self.add_dockwidget(self.waterfallWidget,
+                                              title=_("Waterfall"))
+        self.dock4 = self.add_dockwidget(self.peakWidget,
+                                              title=_("Peaks"))
 
         ################
         # connect signals
@@ -166,8 +211,40 @@ class MainWindow(QMainWindow):
         self.image1.plot.SIG_MARKER_CHANGED.connect(self.cursorMoved)
         self.greateyesUi.loi.valueChanged.connect(self.cursorMoved)
         self.greateyesUi.deltaPixels.valueChanged.connect(self.cursorMoved)
+        self.greateyesUi.autoSave.stateChanged.connect(self.autoSaveChanged)
+        self.greateyesUi.frameSizeChanged.connect(self.frameSizeChanged)
+        self.greateyesUi.darkBtn.released.connect(
+            lambda: self.startMaster('dark'))
+        self.greateyesUi.biasBtn.released.connect(
+            lambda: self.startMaster('bias'))
+        self.greateyesUi.flatBtn.released.connect(self.loadFlat)
+        self.greateyesUi.spikeSigmaSpin.valueChanged.connect(
+            self.spikeFilter.setSigma)
+        self.greateyesUi.resetHotBtn.released.connect(self.spikeFilter.reset)
+        self.greateyesUi.accumulateCheck.stateChanged.connect(
+            lambda state: self.statistics.reset(
+                self.greateyesUi.windowSpin.value()))
+        self.statsWindowLimit = self.greateyesUi.windowSpin.maximum()
+        self.masterFramesLimit = self.greateyesUi.masterNumSpin.maximum()
+        self.greateyesUi.windowSpin.valueChanged.connect(
+            self.setStatisticsWindow)
+        self.greateyesUi.saveStatsBtn.released.connect(self.saveStatistics)
+        self.greateyesUi.waterfallCombo.currentIndexChanged.connect(
+            lambda idx: self.updateWaterfall())
+        self.greateyesUi.exportWaterfallBtn.released.connect(
+            self.saveWaterfall)
+        self.greateyesUi.peakBtn.released.connect(self.setPeakWindows)
+        self.greateyesUi.peakCombo.currentIndexChanged.connect(
+            lambda idx: self.updatePeaks(force=True))
+        self.greateyesUi.exportPeaksBtn.released.connect(self.savePeaks)
+
+        ################
+        # thread for writing frames to file
+        self.frameWriter = FrameWriter()
+        self.frameWriter.message.connect(self.updateStatus)
 
-        #self.curveWidget1.calcFun.idxChanged.connect(self.signal1.funChanged)
+        self.greateyesUi.calibBtn.released.connect(self.fitCalibration)
+        self.curveWidget1.calcFun.idxChanged.connect(self.signal1.funChanged)
         #self.fileUi.saveTxtBtn.released.connect(self.saveDataTxt)
         #self.fileUi.saveHdfBtn.released.connect(self.saveDataHDF5)
         '''
@@ -251,44 +328,275 @@ class MainWindow(QMainWindow):
         
     def closeEvent(self, event):
         self.greateyesUi.closeEvent(event)
+        self.frameWriter.close()
         if self.console is not None:
             self.console.exit_interpreter()
         event.accept()
 
     def newData(self, image, timeStamp):
-        self.image1.updatePlot(image, 
-                timeStamp.isoformat() + ", " +
-                str(self.greateyesUi.cameraSettings['temperature']) +
+        try:
+            self.__processFrame(image, timeStamp)
+        finally:
+            # camera buffer of image may be reused, next frame handed over
+            self.greateyesUi.frameDone()
+
+    def __processFrame(self, image, timeStamp):
+        settings = self.greateyesUi.cameraSettings
+        if self.correction.isRecording():
+            if self.correction.addFrame(image):
+                self.updateStatus('Master frame recorded')
+        # raw frame is saved, corrected one displayed
+        if self.greateyesUi.correctCheck.isChecked():
+            frame = self.correction.apply(image, settings)
+        else:
+            frame = image
+        frame = self.spikeFilter.apply(frame,
+                self.greateyesUi.spikeCombo.currentText())
+        if self.greateyesUi.accumulateCheck.isChecked():
+            self.statistics.addFrame(frame)
+            product = self.greateyesUi.displayCombo.currentText()
+            if product != 'frame':
+                frame = self.statistics.get(product)
+        self.image1.updatePlot(frame, 
+                str(toIso(timeStamp)) + ", " +
+                str(settings['temperature']) +
                 "°C")
-        self.updateLineOut(image)
+        self.lineOut.setImage(frame)
+        lineout = self.updateLineOut()
+        self.waterfall.add(lineout, timeStamp)
+        self.updateWaterfall()
+        self.peakTracker.add(lineout, timeStamp)
+        self.updatePeaks()
         self.saveDataHDF5(image, timeStamp)
 
+    def saveStatistics(self):
+        if self.statistics.isEmpty():
+            self.updateStatus('Nothing accumulated yet')
+            return
+        fileName = self.fileName('_statistics.h5')
+        self.statistics.save(fileName,
+                {'comment': self.greateyesUi.comment.toPlainText()})
+        self.updateStatus(fileName + " saved")
+
+    def fitCalibration(self):
+        '''
+        Fit pixel to energy calibration to reference lines 'pixel:eV, ...'
+        '''
+        try:
+            lines = [pair.split(':') for pair in
+                     self.greateyesUi.calibEdit.text().split(',') if pair.strip()]
+            # lineout pixels, the fit is in unbinned coordinates
+            pixels = self.calibration.toUnbinned([float(p) for p, e in lines])
+            energies = [float(e) for p, e in lines]
+        except ValueError:
+            self.updateStatus('Calibration has to be given as pixel:eV, ...')
+            return
+        if len(pixels) < 2:
+            self.updateStatus('Need at least two reference lines')
+            return
+        residuals = self.calibration.fit(pixels, energies,
+                                         self.greateyesUi.calibOrderSpin.value())
+        self.updateStatus('Calibration fitted, max residual {:.3g} eV'.format(
+            np.abs(residuals).max()))
+
+    def startMaster(self, kind):
+        '''
+        Record master dark or bias from the next n frames
+        '''
+        if self.greateyesUi.camera is None:
+            self.updateStatus('Camera not connected')
+            return
+        settings = {
+            'exposure_time': self.greateyesUi.exposureTimeSpin.value(),
+            'readout_speed': self.greateyesUi.readoutSpeedCombo.currentText(),
+            'set_temperature': self.greateyesUi.temperatureSpin.value()}
+        settings.update(self.greateyesUi.frameSettings())
+        self.correction.startMaster(kind, settings,
+                self.greateyesUi.masterNumSpin.value(),
+                self.greateyesUi.masterMethodCombo.currentText())
+        self.updateStatus('Recording master {:s} from {:d} frames'.format(kind,
+                self.greateyesUi.masterNumSpin.value()))
+
+    def loadFlat(self):
+        '''
+        Load flat field from .npy or mean of all frames of a session file
+        '''
+        fileName = QFileDialog.getOpenFileName(self, 'Load flat field',
+                self.greateyesUi.directory, 'Flat (*.npy *.h5)')[0]
+        if not fileName:
+            return
+        if fileName.endswith('.h5'):
+            import h5py
+            with h5py.File(fileName, 'r') as f:
+                flat = f['image'][...].mean(axis=0, dtype=np.float64)
+        else:
+            flat = np.load(fileName)
+        self.correction.setFlat(flat)
+        self.updateStatus('Flat field loaded from ' + fileName)
+
+    def frameSizeChanged(self, nx, ny):
+        '''
+        Binning or crop mode changed the size of the frames
+        '''
+        self.frameWidth = nx
+        binning = 2**min(self.greateyesUi.binningXCombo.currentIndex(), 7)
+        self.calibration.setGeometry(binning, nx)
+        self.cursorMoved(self.greateyesUi.loi.value())
+        # ring of the statistics window has to fit into memory
+        maxLen = min(self.statsWindowLimit,
+                     self.statistics.maxWindowLen((ny, nx)))
+        if self.greateyesUi.windowSpin.value() > maxLen:
+            self.updateStatus('Statistics window limited to {:d} frames '
+                '({:d} MB) for {:d}x{:d} pixel'.format(maxLen,
+                self.statistics.maxRingBytes // 2**20, nx, ny))
+        self.greateyesUi.windowSpin.setMaximum(maxLen)
+        # same for the stack of frames of a master
+        maxFrames = min(self.masterFramesLimit,
+                        self.correction.maxMasterFrames((ny, nx)))
+        if self.greateyesUi.masterNumSpin.value() > maxFrames:
+            self.updateStatus('Master frames limited to {:d} ({:d} MB) for '
+                '{:d}x{:d} pixel'.format(maxFrames,
+                self.correction.maxStackBytes // 2**20, nx, ny))
+        self.greateyesUi.masterNumSpin.setMaximum(maxFrames)
+
+    def setStatisticsWindow(self, windowLen):
+        n = self.statistics.setWindowLen(windowLen)
+        if n < windowLen:
+            self.updateStatus('Statistics window limited to {:d} frames '
+                '({:d} MB)'.format(n, self.statistics.maxRingBytes // 2**20))
+
+    def fileName(self, suffix, timeStamp=None):
+        '''
+        Path in data directory starting with date and time, with number of
+        camera if there are several
+        '''
+        timeStamp = (datetime.datetime.now() if timeStamp is None
+                     else toDatetime(timeStamp))
+        fileName = (self.greateyesUi.directory + "/" +
+                    timeStamp.strftime('%Y%m%d-%H%M%S'))
+        if self.numCameras > 1:
+            fileName += '_cam{:d}'.format(self.addr)
+        return fileName + suffix
+
     def updateStatus(self, msg):
         self.status.showMessage(msg, 10000)
 
-    def updateLineOut(self, image):
+    def updateLineOut(self):
+        if self.lineOut.isEmpty():
+            return
         loi  = self.greateyesUi.loi.value()
         dLoi = self.greateyesUi.deltaPixels.value()
-        data = image[(loi-dLoi):(loi+dLoi+1),:]
+        # cheap, only two lines of the cumulative sum are subtracted
+        data = self.lineOut.band(loi, dLoi)
         self.signal1.updatePlot(np.column_stack((np.arange(0,
-               data.shape[1]), data.sum(axis=0))))
+               data.shape[0]), data)))
         self.image1.setHCursor(loi)
-        self.image1.setRoi(0, loi-dLoi, 2048, loi+dLoi)
+        self.image1.setRoi(0, loi-dLoi, self.frameWidth, loi+dLoi)
+        return data
+
+    def updateWaterfall(self):
+        if self.waterfall.isEmpty():
+            return
+        name = self.greateyesUi.waterfallCombo.currentText()
+        times, data = self.waterfall.get(name)
+        if len(times) == 0:
+            return
+        self.waterfallImage.updatePlot(data, '{:s}: {:d} lineouts, {:.0f} s'.format(
+            name, len(times), (times[-1] - times[0])*1e-9))
+
+    def saveWaterfall(self):
+        if self.waterfall.isEmpty():
+            self.updateStatus('No lineouts yet')
+            return
+        resample = None
+        if self.greateyesUi.energyGridCheck.isChecked():
+            if not self.calibration.isCalibrated():
+                self.updateStatus('No calibration, waterfall in pixels only')
+            elif self.waterfall.nPixels != self.calibration.nPixels:
+                self.updateStatus('Frame size changed, waterfall in pixels only')
+            else:
+                resample = self.calibration.resample
+        fileName = self.fileName('_waterfall.h5')
+        self.waterfall.save(fileName,
+                {'comment': self.greateyesUi.comment.toPlainText()}, resample)
+        self.updateStatus(fileName + " saved")
+
+    def setPeakWindows(self):
+        '''
+        Track peaks in windows given as 'from-to, ...' in lineout pixels
+        '''
+        try:
+            windows = [[int(p) for p in w.split('-')] for w in
+                       self.greateyesUi.peakEdit.text().split(',') if w.strip()]
+            self.peakTracker.setWindows(windows)
+        except ValueError:
+            self.updateStatus('Peak windows have to be given as from-to, ...')
+            return
+        plot = self.peakWidget.get_plot()
+        for signal in self.peakSignals:
+            plot.del_item(signal.curve)
+        colors = 'bgrcmyk'
+        self.peakSignals = [SignalFT(self, plot=plot, col=colors[i % len(colors)])
+                            for i in range(self.peakTracker.numWindows())]
+        plot.replot()
+        self.updateStatus('Tracking {:d} peaks'.format(len(self.peakSignals)))
+
+    def updatePeaks(self, force=False):
+        '''
+        Plot history of the peaks at most twice per s, every n-th point of
+        long histories so at most maxPeakPoints are plotted
+        '''
+        if self.peakTracker.count == 0:
+            return
+        if not force and time.monotonic() - self.peaksShown < 0.5:
+            return
+        self.peaksShown = time.monotonic()
+        times, values = self.peakTracker.get(
+            self.greateyesUi.peakCombo.currentText())
+        step = -(-len(times) // self.maxPeakPoints)
+        # latest point is always plotted
+        shown = slice((len(times)-1) % step, None, step)
+        x = toSeconds(times[shown], times[0])
+        for i, signal in enumerate(self.peakSignals):
+            signal.curve.set_data(x, values[shown,i])
+        self.peakWidget.get_plot().replot()
+
+    def savePeaks(self):
+        if self.peakTracker.count == 0:
+            self.updateStatus('No peaks tracked yet')
+            return
+        fileName = self.fileName('_peaks.h5')
+        self.peakTracker.save(fileName,
+                {'comment': self.greateyesUi.comment.toPlainText()})
+        self.updateStatus(fileName + " saved")
 
                
+    def autoSaveChanged(self, state):
+        '''
+        Start a new session file when auto save gets checked
+        '''
+        if state == 2:
+            fileName = self.fileName('_session.h5')
+            self.frameWriter.openSession(fileName,
+                {'comment': self.greateyesUi.comment.toPlainText()},
+                self.greateyesUi.compressionCombo.currentText(),
+                self.greateyesUi.compressionLevel.value())
+        else:
+            self.frameWriter.closeSession()
+
     def saveDataHDF5(self, image, timeStamp):
         if not self.greateyesUi.autoSave.isChecked():
             return
-        zeit = timeStamp.strftime('%Y%m%d-%H%M%S')
-        fileName = self.greateyesUi.directory + "/" + zeit
-        #fileName = QDir.toNativeSeparators(fileName)
-        print(fileName)
-
-        # save matlab file
-        savemat(fileName, {'image': image, 
-            'comment': self.greateyesUi.comment.toPlainText(),
-            'camera_settings': self.greateyesUi.cameraSettings})
-        # save images
+        # written in thread of frameWriter
+        self.frameWriter.addFrame(image, timeStamp,
+                                  self.greateyesUi.cameraSettings)
+
+        # save images, but not more often than every n seconds
+        pngIntervall = self.greateyesUi.pngInterSpin.value()
+        if pngIntervall == 0 or time.monotonic() - self.lastPng < pngIntervall:
+            return
+        self.lastPng = time.monotonic()
+        fileName = self.fileName('', timeStamp)
         self.image1.plot.save_widget(fileName + '_image.png')
         self.signal1.plot.save_widget(fileName + '_lineout.png')
 
@@ -309,18 +617,45 @@ class MainWindow(QMainWindow):
             self.greateyesUi.loi.setValue(cursorVal)
         else:
             cursorVal = self.greateyesUi.loi.value()  
+        if not self.lineOut.isEmpty():
+            # sets cursor and roi as well
+            self.updateLineOut()
+            return
         self.image1.setHCursor(cursorVal)
         roi = self.greateyesUi.deltaPixels.value()
-        self.image1.setRoi(0, cursorVal-roi, 2048, cursorVal+roi)
+        self.image1.setRoi(0, cursorVal-roi, self.frameWidth, cursorVal+roi)
 
 
-def run():
+def run(numCameras=1):
+    '''
+    One window per camera, all in one process sharing the sdk and the
+    time base
+    '''
     from guidata import qapplication
     app = qapplication()
-    window = MainWindow()
-    window.show()
+    sdk = None # loaded when the camera is connected
+    if numCameras > 1:
+        sdk = loadSdk()
+        if sdk.hasFunction('ConnectToMultiCameraSystem'):
+            try:
+                numCameras = min(numCameras, sdk.connectMultiCameraSystem())
+            except GreatEyesError as e:
+                print(e, '\nUsing a single camera')
+                numCameras = 1
+        else:
+            numCameras = 1
+        if numCameras == 0:
+            msg = QMessageBox()
+            msg.setIcon(QMessageBox.Critical)
+            msg.setText('No camera found')
+            msg.exec_()
+            return
+    windows = [MainWindow(addr, sdk, numCameras) for addr in range(numCameras)]
+    for window in windows:
+        window.show()
     app.exec_()
 
 
 if __name__ == '__main__':
-    run()
+    # number of cameras as optional argument
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Pixel to photon energy calibration of the XUV spectrometer
+"""
+
+import json
+import os.path as osp
+import numpy as np
+from scipy import sparse
+
+
+class SpectrometerCalibration:
+    '''
+    Polynomial E(pixel) in unbinned pixel coordinates, fitted to reference
+    lines. Energy of every pixel is precomputed once per (binning, number
+    of pixels), conversions for the lineout axis only interpolate in this
+    table. Lineouts can be resampled to a uniform energy grid by a sparse
+    linear interpolation matrix which is cached as well.
+    '''
+    hc = 1239.841984 # eV nm
+    def __init__(self, fileName='calibration.json'):
+        self.fileName = fileName
+        self.coeffs = None # highest order first, like np.polyfit
+        self.binning = 1 # current horizontal binning factor
+        self.nPixels = 2048 # current number of pixels of lineout
+        self.tables = {}
+        self.matrices = {}
+        self.load()
+
+    def isCalibrated(self):
+        return self.coeffs is not None
+
+    def fit(self, pixels, energies, order=2):
+        '''
+        Fit polynomial to reference lines (unbinned pixel, energy in eV),
+        returns the residuals in eV
+        '''
+        pixels = np.asarray(pixels, dtype=np.float64)
+        energies = np.asarray(energies, dtype=np.float64)
+        order = min(order, len(pixels)-1)
+        self.coeffs = np.polyfit(pixels, energies, order)
+        self.tables.clear()
+        self.matrices.clear()
+        self.save()
+        return energies - np.polyval(self.coeffs, pixels)
+
+    def save(self):
+        with open(self.fileName, 'w') as f:
+            json.dump({'coefficients': list(self.coeffs)}, f)
+
+    def load(self):
+        if not osp.isfile(self.fileName):
+            return
+        with open(self.fileName) as f:
+            self.coeffs = np.array(json.load(f)['coefficients'])
+
+    def setGeometry(self, binning, nPixels):
+        '''
+        Binning factor and number of pixels of the lineouts
+        '''
+        self.binning = binning
+        self.nPixels = nPixels
+
+    def toUnbinned(self, pixel):
+        '''
+        Pixel of the binned lineout to unbinned pixel coordinates
+        '''
+        return (np.asarray(pixel, dtype=np.float64) + 0.5)*self.binning - 0.5
+
+    def energyTable(self):
+        '''
+        Photon energy of every pixel for current binning
+        '''
+        key = (self.binning, self.nPixels)
+        if key not in self.tables:
+            # centre of binned pixel in unbinned coordinates
+            x = (np.arange(self.nPixels) + 0.5)*self.binning - 0.5
+            self.tables[key] = np.polyval(self.coeffs, x)
+        return self.tables[key]
+
+    def toEnergy(self, pixel):
+        if not self.isCalibrated():
+            return pixel
+        table = self.energyTable()
+        return np.interp(pixel, np.arange(table.size), table)
+
+    def toPixel(self, energy):
+        if not self.isCalibrated():
+            return energy
+        table = self.energyTable()
+        pixel = np.arange(table.size)
+        if table[0] > table[-1]:
+            return np.interp(energy, table[::-1], pixel[::-1])
+        return np.interp(energy, table, pixel)
+
+    def toWavelength(self, pixel):
+        '''
+        Wavelength in nm, pixel unchanged without calibration
+        '''
+        if not self.isCalibrated():
+            return pixel
+        return self.hc / self.toEnergy(pixel)
+
+    def fromWavelength(self, wavelength):
+        if not self.isCalibrated():
+            return wavelength
+        return self.toPixel(self.hc / wavelength)
+
+    def resampleMatrix(self, num=None):
+        '''
+        Sparse matrix (num, nPixels) interpolating a lineout linearly on a
+        uniform energy grid, returns grid and matrix
+        '''
+        num = num or self.nPixels
+        key = (self.binning, self.nPixels, num)
+        if key not in self.matrices:
+            table = self.energyTable()
+            order = np.argsort(table)
+            e = table[order]
+            grid = np.linspace(e[0], e[-1], num)
+            idx = np.clip(np.searchsorted(e, grid), 1, e.size-1)
+            w = (grid - e[idx-1]) / (e[idx] - e[idx-1])
+            rows = np.repeat(np.arange(num), 2)
+            cols = order[np.column_stack((idx-1, idx))].ravel()
+            weights = np.column_stack((1-w, w)).ravel()
+            matrix = sparse.csr_matrix((weights, (rows, cols)),
+                                       shape=(num, self.nPixels))
+            self.matrices[key] = (grid, matrix)
+        return self.matrices[key]
+
+    def resample(self, lineout, num=None):
+        '''
+        Lineout(s) on uniform energy grid, lineout has shape (nPixels,) or
+        (nPixels, n) for several at once
+        '''
+        grid, matrix = self.resampleMatrix(num)
+        return grid, matrix.dot(lineout)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Growable table of numpy columns for logging
+"""
+
+import numpy as np
+
+
+class ColumnStore:
+    '''
+    Columns are preallocated numpy arrays, their capacity grows in whole
+    chunks and at least doubles, so appending is amortized O(1). Columns
+    are handed out as views of the filled part without copying.
+    Appending is done from one thread only. Readers in other threads see a
+    consistent table, views taken before the arrays grew stay valid.
+    '''
+    def __init__(self, dtypes, chunkSize=65536):
+        self.dtypes = list(dtypes) # (name, dtype)
+        self.chunkSize = chunkSize
+        self.clear()
+
+    def clear(self):
+        self.columns = {name: np.zeros(self.chunkSize, dtype=dt)
+                        for name, dt in self.dtypes}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def capacity(self):
+        return len(next(iter(self.columns.values())))
+
+    def __grow(self, needed):
+        chunks = -(-max(needed, 2*self.capacity()) // self.chunkSize)
+        columns = {}
+        for name, column in self.columns.items():
+            columns[name] = np.zeros(chunks*self.chunkSize, dtype=column.dtype)
+            columns[name][:self.count] = column[:self.count]
+        self.columns = columns
+
+    def append(self, **values):
+        '''
+        Append rows, one array (or scalar) per column, returns index of
+        first new row
+        '''
+        n = max(np.size(value) for value in values.values())
+        start = self.count
+        if start + n > self.capacity():
+            self.__grow(start + n)
+        for name, value in values.items():
+            self.columns[name][start:start+n] = value
+        self.count = start + n # rows are visible after they are written
+        return start
+
+    def column(self, name, start=0, stop=None):
+        '''
+        View of column, no copy
+        '''
+        count = self.count
+        stop = count if stop is None else min(stop, count)
+        return self.columns[name][start:stop]
+
+    def tail(self, start):
+        '''
+        Views of all columns from row start to the end
+        '''
+        count = self.count
+        return {name: column[start:count]
+                for name, column in self.columns.items()}
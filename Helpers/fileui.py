@@ -4,13 +4,11 @@
 #from __future__ import unicode_literals, print_function, division
 
 from guidata.qt.QtGui import (QSplitter, QPushButton, QVBoxLayout, QHBoxLayout,
-                              QGroupBox, QCheckBox, QLabel, QWidget, QPlainTextEdit)
-from guidata.qt.QtCore import (Qt, QThread, Signal)
+                              QGroupBox, QCheckBox, QLabel, QWidget, QPlainTextEdit,
+                              QSpinBox)
+from guidata.qt.QtCore import (Qt, Signal)
 
-import time
 from datetime import datetime
-import numpy as np
-from Helpers.genericthread import GenericWorker
 
 
 class FileUi(QSplitter):
@@ -27,6 +25,11 @@ class FileUi(QSplitter):
         self.saveHdfCheck = QCheckBox('Save HDF5')
         self.saveTxtBtn = QPushButton('Save Txt')
         self.saveHdfBtn = QPushButton('Save HDF5')
+        self.flushSpin = QSpinBox()
+        self.flushSpin.setRange(1, 600)
+        self.flushSpin.setValue(10)
+        self.flushSpin.setPrefix('flush every ')
+        self.flushSpin.setSuffix(' s')
 
         #############
         # stream group
@@ -35,6 +38,7 @@ class FileUi(QSplitter):
         streamGroupLayout = QHBoxLayout()
         streamGroupLayout.addWidget(self.saveTxtCheck)
         streamGroupLayout.addWidget(self.saveHdfCheck)
+        streamGroupLayout.addWidget(self.flushSpin)
         streamGroup.setLayout(streamGroupLayout)
 
         ##############
@@ -59,27 +63,16 @@ class FileUi(QSplitter):
         self.saveTxtCheck.stateChanged.connect(self.__makeFileName)
         self.saveHdfCheck.stateChanged.connect(self.__makeFileName)
 
-        ##############
-        # thread for streaming data to file
-        #self.updateCurrPos.connect(self.__updateCurrPos)
-        self.stream_thread = QThread() # create the QThread
-        self.stream_thread.start()
-        self.stream_worker = GenericWorker(self.__streamFile)
-        self.stream_worker.moveToThread(self.stream_thread)
-
     def __makeFileName(self, state):
+        '''
+        Name of stream file, the owner of the data opens the stream
+        connected to stateChanged of saveHdfCheck
+        '''
         if state == 2:
             self.fileName = datetime.now().strftime('%Y%m%d-%H%M%S')
-            self.stream_worker.start.emit()
         else:
             self.fileName = None
 
-    def __streamFile(self):
-        while self.saveHdfCheck.isChecked():
-            self.saveHdfBtn.released.emit()
-            time.sleep(10)
-        
-
            
 if __name__ == '__main__':
     from guidata.qt.QtGui import QApplication
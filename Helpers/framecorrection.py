@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Dark, bias and flat field correction of camera frames
+"""
+
+import os
+import os.path as osp
+import numpy as np
+
+
+class FrameCorrection:
+    '''
+    Keeps master dark frames per (exposure, temperature, readout speed,
+    binning, crop) and master bias frames per (temperature, readout speed,
+    binning, crop) and applies (raw - dark) / flat to new frames.
+    Masters are the median or sigma clipped mean of n frames, they are
+    saved as .npz in cacheDir and reloaded from there on startup. The
+    stack of recorded frames is limited to maxStackBytes, fewer frames are
+    used for a master if more do not fit, and it is combined in blocks of
+    rows so the temporaries stay small.
+    '''
+    methods = ['median', 'sigma clip']
+    def __init__(self, cacheDir, numBuffers=3, maxStackBytes=1024*2**20,
+                 blockBytes=16*2**20):
+        self.cacheDir = cacheDir
+        self.maxStackBytes = maxStackBytes
+        self.blockBytes = blockBytes # float32 stack of rows per block
+        self.darks = {}
+        self.biases = {}
+        self.flat = None
+
+        # master frame which is currently recorded
+        self.recording = None # (kind, key, method)
+        self.stack = None
+        self.numFrames = 0
+        self.numRecorded = 0
+
+        # output buffers, returned frames stay valid for numBuffers-1 calls
+        self.numBuffers = numBuffers
+        self.bufferPool = []
+        self.bufferIdx = 0
+
+        self.loadMasters()
+
+    @staticmethod
+    def frameKey(settings):
+        '''
+        Binning and crop mode, masters only fit frames of the same layout
+        '''
+        return (int(settings['binning_x']), int(settings['binning_y']),
+                int(settings['crop_lines']))
+
+    @classmethod
+    def darkKey(cls, settings):
+        return (int(settings['exposure_time']),
+                int(settings['set_temperature']),
+                str(settings['readout_speed'])) + cls.frameKey(settings)
+
+    @classmethod
+    def biasKey(cls, settings):
+        return (int(settings['set_temperature']),
+                str(settings['readout_speed'])) + cls.frameKey(settings)
+
+    def __fileName(self, kind, key):
+        name = '_'.join([kind] + [str(k) for k in key])
+        return osp.join(self.cacheDir, name.replace(' ', '') + '.npz')
+
+    def loadMasters(self):
+        '''
+        Load all master frames found in cacheDir
+        '''
+        if not osp.isdir(self.cacheDir):
+            return
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith('.npz'):
+                continue
+            with np.load(osp.join(self.cacheDir, name)) as data:
+                kind = str(data['kind'])
+                key = [str(k) for k in data['key']]
+                # masters saved without binning and crop are not used
+                if kind == 'dark' and len(key) == 6:
+                    self.darks[(int(key[0]), int(key[1]), key[2]) +
+                               tuple(int(k) for k in key[3:])] = data['master']
+                elif kind == 'bias' and len(key) == 5:
+                    self.biases[(int(key[0]), key[1]) +
+                                tuple(int(k) for k in key[2:])] = data['master']
+                elif kind == 'flat':
+                    self.flat = data['master']
+
+    def setFlat(self, flat):
+        '''
+        Set flat field, gets normalized to a mean of 1
+        '''
+        flat = np.asarray(flat, dtype=np.float32)
+        flat = flat / flat.mean()
+        flat[flat <= 0] = 1 # do not divide by zero for dead pixels
+        self.flat = flat
+        self.__save('flat', (), flat)
+
+    def __save(self, kind, key, master):
+        if not osp.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        np.savez(self.__fileName(kind, key), master=master, kind=kind,
+                 key=np.array([str(k) for k in key]))
+
+    def startMaster(self, kind, settings, numFrames=10, method='median'):
+        '''
+        Record master 'dark' or 'bias' with the next numFrames frames
+        '''
+        key = self.darkKey(settings) if kind == 'dark' else self.biasKey(settings)
+        self.recording = (kind, key, method)
+        self.stack = None
+        self.numFrames = numFrames
+        self.numRecorded = 0
+
+    def isRecording(self):
+        return self.recording is not None
+
+    def maxMasterFrames(self, shape, dtype=np.uint16):
+        '''
+        Most frames of shape whose stack fits into maxStackBytes
+        '''
+        frameBytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return max(1, self.maxStackBytes // frameBytes)
+
+    def addFrame(self, frame):
+        '''
+        Add frame to master which is recorded, returns True when the
+        master is complete
+        '''
+        if self.stack is None or self.stack.shape[1:] != frame.shape:
+            self.numFrames = min(self.numFrames,
+                                 self.maxMasterFrames(frame.shape, frame.dtype))
+            self.stack = np.empty((self.numFrames,) + frame.shape,
+                                  dtype=frame.dtype)
+            self.numRecorded = 0
+        self.stack[self.numRecorded] = frame
+        self.numRecorded += 1
+        if self.numRecorded < self.numFrames:
+            return False
+        kind, key, method = self.recording
+        master = self.combine(self.stack, method)
+        if kind == 'dark':
+            self.darks[key] = master
+        else:
+            self.biases[key] = master
+        self.__save(kind, key, master)
+        self.recording = None
+        self.stack = None
+        return True
+
+    def combine(self, stack, method='median'):
+        '''
+        Median or sigma clipped mean along first axis, computed in blocks
+        of rows
+        '''
+        master = np.empty(stack.shape[1:], dtype=np.float32)
+        rowBytes = stack[:, :1].size * np.dtype(np.float32).itemsize
+        rows = max(1, self.blockBytes // rowBytes)
+        for start in range(0, stack.shape[1], rows):
+            block = stack[:, start:start+rows]
+            if method == 'median':
+                master[start:start+rows] = np.median(block, axis=0)
+            else:
+                master[start:start+rows] = self.sigmaClippedMean(block)
+        return master
+
+    @staticmethod
+    def sigmaClippedMean(stack, nSigma=3, iterations=3):
+        '''
+        Mean along first axis without values further than nSigma standard
+        deviations away from the median
+        '''
+        stack = stack.astype(np.float32)
+        center = np.median(stack, axis=0)
+        std = stack.std(axis=0)
+        for i in range(iterations):
+            mask = np.abs(stack - center) <= nSigma*std
+            n = np.maximum(mask.sum(axis=0), 1)
+            center = np.where(mask, stack, 0).sum(axis=0) / n
+            std = np.sqrt(np.where(mask, (stack - center)**2, 0).sum(axis=0) / n)
+        return center.astype(np.float32)
+
+    def hasMaster(self, settings):
+        return (self.darkKey(settings) in self.darks or
+                self.biasKey(settings) in self.biases)
+
+    def __nextBuffer(self, shape):
+        if not self.bufferPool or self.bufferPool[0].shape != shape:
+            self.bufferPool = [np.empty(shape, dtype=np.float32)
+                               for i in range(self.numBuffers)]
+        buf = self.bufferPool[self.bufferIdx % self.numBuffers]
+        self.bufferIdx = (self.bufferIdx + 1) % self.numBuffers
+        return buf
+
+    def apply(self, raw, settings):
+        '''
+        Return (raw - dark) / flat as float32, dark falls back to bias
+        if there is no dark for the current settings
+        '''
+        out = self.__nextBuffer(raw.shape)
+        dark = self.darks.get(self.darkKey(settings))
+        if dark is None:
+            dark = self.biases.get(self.biasKey(settings))
+        if dark is not None and dark.shape == raw.shape:
+            np.subtract(raw, dark, out=out, dtype=np.float32)
+        else:
+            out[...] = raw
+        if self.flat is not None and self.flat.shape == raw.shape:
+            np.divide(out, self.flat, out=out)
+        return out
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Running per pixel statistics of camera frames
+"""
+
+import numpy as np
+
+
+class FrameStatistics:
+    '''
+    Per pixel mean, variance (Welford), min and max over all frames of a
+    session, plus the mean over a sliding window of the last n frames kept
+    in a ring buffer. Memory is allocated once per frame size, the ring is
+    limited to maxRingBytes, a longer window is shortened.
+    '''
+    products = ['mean', 'std', 'min', 'max', 'window mean']
+    def __init__(self, windowLen=10, maxRingBytes=512*2**20):
+        self.windowLen = windowLen # requested, ringLen is used
+        self.maxRingBytes = maxRingBytes
+        self.shape = None
+
+    def reset(self, windowLen=None):
+        if windowLen is not None:
+            self.windowLen = windowLen
+        self.shape = None
+
+    def __alloc(self, shape):
+        self.shape = shape
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+        # temporaries, so no memory is allocated per frame
+        self.delta = np.empty(shape, dtype=np.float64)
+        self.tmp = np.empty(shape, dtype=np.float64)
+        # outputs of get(), reused
+        self.stdOut = np.empty(shape, dtype=np.float64)
+        self.windowOut = np.empty(shape, dtype=np.float64)
+        self.min = np.full(shape, np.inf, dtype=np.float32)
+        self.max = np.full(shape, -np.inf, dtype=np.float32)
+        self.__allocRing()
+
+    def maxWindowLen(self, shape):
+        '''
+        Longest window whose ring fits into maxRingBytes for frames of shape
+        '''
+        frameBytes = int(np.prod(shape)) * np.dtype(np.float32).itemsize
+        return max(1, self.maxRingBytes // frameBytes)
+
+    def __allocRing(self):
+        self.ringLen = min(self.windowLen, self.maxWindowLen(self.shape))
+        self.ring = np.zeros((self.ringLen,) + self.shape, dtype=np.float32)
+        self.ringIdx = 0
+        self.ringCount = 0
+        self.ringSum = np.zeros(self.shape, dtype=np.float64)
+
+    def setWindowLen(self, windowLen):
+        '''
+        Change length of sliding window, keeps the session statistics.
+        Returns the length used, shorter if the ring would be too large.
+        '''
+        self.windowLen = windowLen
+        if self.shape is None:
+            return windowLen
+        self.__allocRing()
+        return self.ringLen
+
+    def addFrame(self, frame):
+        '''
+        Update all statistics with new frame, O(pixel)
+        '''
+        if self.shape != frame.shape:
+            # new session or frame size changed (binning)
+            self.__alloc(frame.shape)
+        self.count += 1
+        # Welford
+        np.subtract(frame, self.mean, out=self.delta)
+        np.divide(self.delta, self.count, out=self.tmp)
+        self.mean += self.tmp
+        np.subtract(frame, self.mean, out=self.tmp)
+        self.tmp *= self.delta
+        self.m2 += self.tmp
+        np.minimum(self.min, frame, out=self.min)
+        np.maximum(self.max, frame, out=self.max)
+        # sliding window
+        if self.ringCount == self.ringLen:
+            self.ringSum -= self.ring[self.ringIdx]
+        else:
+            self.ringCount += 1
+        self.ring[self.ringIdx] = frame
+        self.ringSum += self.ring[self.ringIdx]
+        self.ringIdx = (self.ringIdx + 1) % self.ringLen
+
+    def isEmpty(self):
+        return self.shape is None or self.count == 0
+
+    def variance(self):
+        return self.m2 / max(self.count - 1, 1)
+
+    def get(self, product):
+        '''
+        Return one of the products as array, the arrays are reused by the
+        next call
+        '''
+        if product == 'mean':
+            return self.mean
+        elif product == 'std':
+            np.divide(self.m2, max(self.count - 1, 1), out=self.stdOut)
+            return np.sqrt(self.stdOut, out=self.stdOut)
+        elif product == 'min':
+            return self.min
+        elif product == 'max':
+            return self.max
+        elif product == 'window mean':
+            return np.divide(self.ringSum, self.ringCount, out=self.windowOut)
+        raise ValueError('Unknown product ' + product)
+
+    def save(self, fileName, attrs={}):
+        '''
+        Save all products in one HDF5 file
+        '''
+        import h5py
+        with h5py.File(fileName, 'w') as f:
+            for key, value in attrs.items():
+                f.attrs[key] = value
+            f.attrs['frames'] = self.count
+            f.attrs['window_length'] = self.ringCount
+            for product in self.products:
+                f.create_dataset(product.replace(' ', '_'),
+                                 data=self.get(product), compression='gzip')
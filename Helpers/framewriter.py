@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Write camera frames in a background thread into one HDF5 file per session
+"""
+
+from guidata.qt.QtCore import (QObject, QThread, Signal)
+
+import time
+import numpy as np
+from queue import Queue, Full
+import h5py
+try:
+    # provides lz4 and blosc filters for h5py
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+from Helpers.genericthread import GenericWorker
+
+
+class FrameWriter(QObject):
+    '''
+    Appends frames to a chunked, compressed and extendable dataset 'image'
+    of one HDF5 file per session. Time stamps and camera settings are saved
+    as parallel datasets with one entry per frame.
+    Frames are handed over by a bounded queue and written in a thread, so
+    neither display nor acquisition has to wait for the disk.
+    '''
+    message = Signal(object)
+    compressions = ['gzip', 'lz4', 'blosc']
+    def __init__(self, maxQueue=32, flushIntervall=1.):
+        super(FrameWriter, self).__init__()
+
+        self.queue = Queue(maxQueue)
+        self.flushIntervall = flushIntervall # s
+        self.droppedFrames = 0 # not saved as the queue was full
+
+        self.writer_thread = QThread()
+        self.writer_thread.start()
+        self.writer_worker = GenericWorker(self.__writeFrames)
+        self.writer_worker.moveToThread(self.writer_thread)
+        self.writer_worker.start.emit()
+
+    def openSession(self, fileName, attrs={}, compression='gzip', level=4):
+        '''
+        Start new session file, gets created with the first frame
+        '''
+        self.droppedFrames = 0
+        self.queue.put(('open', fileName, dict(attrs), compression, level))
+
+    def addFrame(self, image, timeStamp, settings={}):
+        '''
+        Queue frame for writing, time stamp in ns since epoch. Image is
+        copied as it might be a view on a buffer of the camera. Does not
+        block, if the queue is full the frame is dropped and counted.
+        Returns False if dropped.
+        '''
+        try:
+            self.queue.put_nowait(('frame', np.array(image, dtype=np.uint16),
+                                   timeStamp, dict(settings)))
+            return True
+        except Full:
+            self.droppedFrames += 1
+            if self.droppedFrames % 10 == 1:
+                self.message.emit('{:d} frames not saved, disk too slow'
+                                  .format(self.droppedFrames))
+            return False
+
+    def closeSession(self):
+        self.queue.put(('close',))
+
+    def close(self):
+        '''
+        Write all queued frames, close file and stop thread
+        '''
+        self.queue.put(('quit',))
+        self.writer_thread.quit()
+        self.writer_thread.wait()
+
+    def __compressionArgs(self, compression, level):
+        if compression in ('lz4', 'blosc'):
+            if hdf5plugin is not None:
+                if compression == 'lz4':
+                    return dict(hdf5plugin.LZ4())
+                return dict(hdf5plugin.Blosc(clevel=level))
+            self.message.emit('hdf5plugin not installed, using gzip')
+        return {'compression': 'gzip', 'compression_opts': level}
+
+    def __createFile(self, session, image, settings):
+        fileName, attrs, compression, level = session
+        f = h5py.File(fileName, 'w')
+        for key, value in attrs.items():
+            f.attrs[key] = value
+        f.create_dataset('image', shape=(0,) + image.shape,
+                         maxshape=(None,) + image.shape,
+                         chunks=(1,) + image.shape, dtype=np.uint16,
+                         **self.__compressionArgs(compression, level))
+        f.create_dataset('time_stamp', shape=(0,), maxshape=(None,),
+                         dtype=np.int64, chunks=(1024,))
+        f['time_stamp'].attrs['unit'] = 'ns since epoch (UTC)'
+        for key, value in settings.items():
+            if key == 'time_stamp':
+                continue
+            dt = np.float64 if isinstance(value, (int, float, type(None))) \
+                            else 'S32'
+            f.create_dataset(key, shape=(0,), maxshape=(None,),
+                             dtype=dt, chunks=(1024,))
+        return f
+
+    def __append(self, f, image, timeStamp, settings):
+        n = f['image'].shape[0]
+        f['image'].resize(n+1, axis=0)
+        f['image'][n] = image
+        f['time_stamp'].resize(n+1, axis=0)
+        f['time_stamp'][n] = timeStamp
+        for key, value in settings.items():
+            if key not in f or key == 'time_stamp':
+                continue
+            f[key].resize(n+1, axis=0)
+            if f[key].dtype.kind == 'f':
+                f[key][n] = np.nan if value is None else value
+            else:
+                f[key][n] = str(value).encode()[:32]
+
+    def __closeFile(self, f, fileName):
+        n = f['image'].shape[0]
+        f.close()
+        self.message.emit('{:s} closed, {:d} frames'.format(fileName, n))
+
+    def __writeFrames(self):
+        '''
+        Function run in thread
+        '''
+        f = None
+        session = None
+        baseName = None # file name given to openSession
+        part = 0
+        lastFlush = time.monotonic()
+        while True:
+            cmd = self.queue.get()
+            try:
+                if cmd[0] == 'frame':
+                    image, timeStamp, settings = cmd[1:]
+                    if session is None:
+                        continue
+                    if f is not None and f['image'].shape[1:] != image.shape:
+                        # frame size changed, continue in a new file
+                        self.__closeFile(f, session[0])
+                        f = None
+                        part += 1
+                        session[0] = '{:s}_{:d}.h5'.format(
+                            baseName.rsplit('.h5', 1)[0], part)
+                    if f is None:
+                        f = self.__createFile(session, image, settings)
+                        self.message.emit(session[0] + ' opened')
+                    self.__append(f, image, timeStamp, settings)
+                    if time.monotonic() - lastFlush > self.flushIntervall:
+                        f.flush()
+                        lastFlush = time.monotonic()
+                elif cmd[0] in ('open', 'close', 'quit'):
+                    if f is not None:
+                        self.__closeFile(f, session[0])
+                        f = None
+                    session = list(cmd[1:]) if cmd[0] == 'open' else None
+                    baseName = cmd[1] if cmd[0] == 'open' else None
+                    part = 0
+                    if cmd[0] == 'quit':
+                        break
+            except Exception as e:
+                self.message.emit('Error writing frame: ' + str(e))
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Online histogram and quantiles of a stream of values, e.g. pulse energies
+"""
+
+from bisect import bisect_right
+import numpy as np
+
+
+class P2Quantiles:
+    '''
+    Extended P² algorithm (Jain, Chlamtac 1985; Raatikainen 1987): a few
+    markers approximate several quantiles at once with constant memory and
+    O(number of quantiles) per value.
+    '''
+    def __init__(self, quantiles=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)):
+        self.quantiles = sorted(quantiles)
+        q = [0.] + self.quantiles + [1.]
+        # markers at the quantiles and half way between them
+        self.probs = sorted(set(q + [(a + b)/2 for a, b in zip(q, q[1:])]))
+        self.index = [self.probs.index(p) for p in self.quantiles]
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.heights = []
+        self.positions = list(range(1, len(self.probs)+1))
+        self.desired = [1. + (len(self.probs)-1)*p for p in self.probs]
+
+    def add(self, values):
+        for x in values:
+            self.__add(float(x))
+
+    def __add(self, x):
+        h = self.heights
+        m = len(self.probs)
+        self.count += 1
+        if self.count <= m:
+            # exact until every marker has a value
+            h.insert(bisect_right(h, x), x)
+            return
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[-1]:
+            h[-1] = x
+            k = m - 2
+        else:
+            k = bisect_right(h, x) - 1
+        n = self.positions
+        for i in range(k+1, m):
+            n[i] += 1
+        d = self.desired
+        for i in range(m):
+            d[i] += self.probs[i]
+        for i in range(1, m-1):
+            delta = d[i] - n[i]
+            if (delta >= 1 and n[i+1] - n[i] > 1) or \
+                    (delta <= -1 and n[i-1] - n[i] < -1):
+                s = 1 if delta > 0 else -1
+                # parabolic prediction, linear if it is not monotonic
+                hp = h[i] + s/(n[i+1] - n[i-1])*(
+                    (n[i] - n[i-1] + s)*(h[i+1] - h[i])/(n[i+1] - n[i]) +
+                    (n[i+1] - n[i] - s)*(h[i] - h[i-1])/(n[i] - n[i-1]))
+                if not h[i-1] < hp < h[i+1]:
+                    hp = h[i] + s*(h[i+s] - h[i])/(n[i+s] - n[i])
+                h[i] = hp
+                n[i] += s
+
+    def values(self):
+        '''
+        Estimates of the quantiles, nan without data
+        '''
+        if self.count == 0:
+            return np.full(len(self.quantiles), np.nan)
+        if self.count <= len(self.probs):
+            return np.quantile(self.heights, self.quantiles)
+        return np.array([self.heights[i] for i in self.index])
+
+
+class AutoHistogram:
+    '''
+    Histogram with a fixed number of bins whose range follows the data.
+    The range is set by the first values; a value outside doubles the
+    range by merging neighbouring bins, so memory stays constant and every
+    value is counted exactly once. Quantiles are estimated with P².
+    '''
+    def __init__(self, numBins=256, quantiles=(0.01, 0.05, 0.25, 0.5, 0.75,
+                                                0.95, 0.99)):
+        self.numBins = numBins + numBins % 2 # merging needs pairs
+        self.quantiles = P2Quantiles(quantiles)
+        self.clear()
+
+    def clear(self):
+        self.counts = np.zeros(self.numBins, dtype=np.int64)
+        self.low = None # lower edge of first bin
+        self.width = None # of one bin
+        self.count = 0
+        self.quantiles.clear()
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        vMin, vMax = values.min(), values.max()
+        if self.low is None:
+            # first range twice the spread of the first values
+            span = 2*(vMax - vMin) or abs(vMax)*1e-3 or 1e-12
+            self.width = span/self.numBins
+            self.low = (vMin + vMax)/2 - span/2
+        while vMin < self.low:
+            self.__merge(down=True)
+        while vMax >= self.low + self.width*self.numBins:
+            self.__merge(down=False)
+        bins = ((values - self.low)/self.width).astype(np.int64)
+        np.clip(bins, 0, self.numBins-1, out=bins) # rounding at the edge
+        self.counts += np.bincount(bins, minlength=self.numBins)
+        self.count += len(values)
+        self.quantiles.add(values)
+
+    def __merge(self, down):
+        '''
+        Double range, bins are merged pairwise and fill one half
+        '''
+        half = self.numBins//2
+        merged = self.counts.reshape(half, 2).sum(axis=1)
+        self.counts[:] = 0
+        if down:
+            self.counts[half:] = merged
+            self.low -= self.width*self.numBins
+        else:
+            self.counts[:half] = merged
+        self.width *= 2
+
+    def edges(self):
+        if self.low is None:
+            return np.zeros(0)
+        return self.low + self.width*np.arange(self.numBins+1)
+
+    def steps(self):
+        '''
+        x and y of the outline of the histogram for plotting
+        '''
+        if self.low is None:
+            return np.zeros(0), np.zeros(0)
+        return np.repeat(self.edges(), 2)[1:-1], np.repeat(self.counts, 2)
+
+    def datasets(self):
+        '''
+        Name and data of histogram and quantiles for saving
+        '''
+        histogram = np.zeros(self.numBins, dtype=[('low', np.float64),
+                                                  ('high', np.float64),
+                                                  ('count', np.int64)])
+        edges = self.edges()
+        if len(edges):
+            histogram['low'] = edges[:-1]
+            histogram['high'] = edges[1:]
+        histogram['count'] = self.counts
+        quantiles = np.zeros(len(self.quantiles.quantiles),
+                             dtype=[('quantile', np.float64),
+                                    ('value', np.float64)])
+        quantiles['quantile'] = self.quantiles.quantiles
+        quantiles['value'] = self.quantiles.values()
+        return {'energy_histogram': histogram, 'energy_quantiles': quantiles}
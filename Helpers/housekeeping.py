@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Poll slow housekeeping values (temperatures, status) of an instrument
+"""
+
+from guidata.qt.QtCore import (QObject, QMutex)
+
+import time
+import numpy as np
+
+from Helpers.scheduler import Scheduler
+from Helpers.timebase import timeBase
+
+
+class Housekeeping(QObject):
+    '''
+    Reads all registered values every interval seconds in a task,
+    but only while isIdle() is true, so the reads do not queue up behind
+    acquisitions. A loop which keeps the device busy all the time calls
+    pollIfDue() in its dead time instead.
+    The latest values are kept in a dict which is replaced as a whole and
+    never changed, readers just take the reference and need no lock.
+    Every value is appended to a time series which doubles its size when
+    full.
+    '''
+    def __init__(self, interval=2., capacity=1024):
+        super(Housekeeping, self).__init__()
+        self.interval = interval # s
+        self.capacity = capacity
+        self.readers = {}
+        self.latest = {} # name: (value, time of reading in ns)
+        self.isIdle = lambda: True
+        self.lastPoll = 0 # monotonic
+        self.pollMutex = QMutex() # only one poll at a time
+        self.reset()
+
+        self.scheduler = Scheduler()
+        self.pollTask = None
+
+    def addReader(self, name, fun):
+        '''
+        fun() returns the current value as number or None if it failed
+        '''
+        self.readers[name] = fun
+        self.reset()
+
+    def reset(self):
+        '''
+        Start new time series, e.g. for a new session
+        '''
+        self.times = np.zeros(self.capacity, dtype=np.int64)
+        self.values = np.full((self.capacity, len(self.readers)), np.nan,
+                              dtype=np.float64)
+        self.count = 0
+
+    def get(self, name, default=None):
+        '''
+        Latest value, lock free
+        '''
+        return self.latest.get(name, (default, 0))[0]
+
+    def age(self, name):
+        '''
+        Seconds since the value was read
+        '''
+        readTime = self.latest.get(name, (None, 0))[1]
+        return (timeBase.nanoseconds() - readTime)*1e-9
+
+    def series(self, name):
+        '''
+        Times (ns since epoch) and values of one reader, views
+        '''
+        i = list(self.readers).index(name)
+        return self.times[:self.count], self.values[:self.count,i]
+
+    def poll(self):
+        '''
+        Read all values now, skipped if a poll is already running
+        '''
+        if not self.pollMutex.tryLock():
+            return
+        try:
+            latest = dict(self.latest)
+            row = np.full(len(self.readers), np.nan)
+            for i, (name, fun) in enumerate(self.readers.items()):
+                value = fun()
+                if value is not None:
+                    latest[name] = (value, timeBase.nanoseconds())
+                    row[i] = value
+            self.lastPoll = time.monotonic()
+            self.latest = latest
+            if self.count == len(self.times):
+                self.times = np.concatenate((self.times,
+                                             np.zeros_like(self.times)))
+                self.values = np.concatenate((self.values,
+                                              np.full_like(self.values, np.nan)))
+            self.times[self.count] = timeBase.nanoseconds()
+            self.values[self.count] = row
+            self.count += 1
+        finally:
+            self.pollMutex.unlock()
+
+    def pollIfDue(self):
+        if time.monotonic() - self.lastPoll >= self.interval:
+            self.poll()
+
+    def start(self, isIdle=lambda: True):
+        '''
+        Start polling in thread whenever isIdle() returns true
+        '''
+        self.isIdle = isIdle
+        if self.pollTask is None or self.pollTask.token.cancelled():
+            self.pollTask = self.scheduler.submit(self.__pollLoop, lane='poll')
+
+    def stop(self):
+        if self.pollTask is not None:
+            self.pollTask.cancel()
+
+    def close(self):
+        self.scheduler.close()
+
+    def __pollLoop(self, token):
+        while not token.wait(0.05):
+            if self.isIdle():
+                self.pollIfDue()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Line outs of camera images
+"""
+
+import numpy as np
+
+
+class LineOut:
+    '''
+    Keeps the cumulative sum along the rows of the current frame. The sum
+    over any band of lines is then the difference of two rows, so moving
+    or resizing the region of interest does not touch the image again.
+    '''
+    def __init__(self):
+        self.cumSum = None # first row is zero, row i+1 is sum of lines 0..i
+
+    def setImage(self, image):
+        '''
+        Build cumulative sum table for a new frame
+        '''
+        # integer frames are summed in uint32, enough for 65537 lines of uint16
+        dt = np.uint32 if image.dtype.kind in 'ub' else np.float64
+        shape = (image.shape[0]+1, image.shape[1])
+        if (self.cumSum is None or self.cumSum.shape != shape or
+                self.cumSum.dtype != dt):
+            self.cumSum = np.zeros(shape, dtype=dt)
+        np.cumsum(image, axis=0, dtype=dt, out=self.cumSum[1:])
+
+    def isEmpty(self):
+        return self.cumSum is None
+
+    def numLines(self):
+        return self.cumSum.shape[0]-1
+
+    def band(self, loi, dLoi):
+        '''
+        Sum over lines loi-dLoi to loi+dLoi (inclusive), clipped to frame
+        '''
+        return self.bands([loi], [dLoi])[0]
+
+    def bands(self, lois, dLois):
+        '''
+        Sum over several bands at once, returns array (len(lois), pixel)
+        '''
+        lois = np.asarray(lois, dtype=int)
+        dLois = np.asarray(dLois, dtype=int)
+        lo = np.clip(lois-dLois, 0, self.numLines())
+        hi = np.clip(lois+dLois+1, 0, self.numLines())
+        return self.cumSum[hi] - self.cumSum[lo]
+
+
+class Waterfall:
+    '''
+    Fixed memory history of lineouts (time x pixel). The last capacity
+    lineouts are kept in a ring buffer which is written twice, at i and
+    i+capacity, so the chronological history is always a contiguous view
+    without copying. Means over decimation lineouts go into a second ring
+    of the same size for the long term history.
+    '''
+    def __init__(self, capacity=1000, decimation=30):
+        self.capacity = capacity
+        self.decimation = decimation
+        self.nPixels = None
+
+    def __alloc(self, nPixels):
+        self.nPixels = nPixels
+        self.rings = {}
+        for name in ('recent', 'long term'):
+            self.rings[name] = [np.zeros((2*self.capacity, nPixels),
+                                         dtype=np.float32),
+                                np.zeros(2*self.capacity, dtype=np.int64),
+                                0, 0] # data, times, index, count
+        self.accSum = np.zeros(nPixels, dtype=np.float64)
+        self.accTime = 0
+        self.accCount = 0
+
+    def clear(self):
+        self.nPixels = None
+
+    def __write(self, name, lineout, t):
+        ring = self.rings[name]
+        data, times, idx, count = ring
+        data[idx] = lineout
+        data[idx+self.capacity] = lineout
+        times[idx] = t
+        times[idx+self.capacity] = t
+        ring[2] = (idx + 1) % self.capacity
+        ring[3] = min(count + 1, self.capacity)
+
+    def add(self, lineout, t):
+        '''
+        Add lineout taken at time t (ns since epoch), O(pixel)
+        '''
+        if self.nPixels != lineout.shape[0]:
+            self.__alloc(lineout.shape[0])
+        self.__write('recent', lineout, t)
+        self.accSum += lineout
+        self.accTime += t
+        self.accCount += 1
+        if self.accCount == self.decimation:
+            self.__write('long term', self.accSum/self.accCount,
+                         self.accTime//self.accCount)
+            self.accSum[...] = 0
+            self.accTime = 0
+            self.accCount = 0
+
+    def isEmpty(self):
+        return self.nPixels is None
+
+    def get(self, name='recent'):
+        '''
+        Times and lineouts in chronological order, views, no copy
+        '''
+        data, times, idx, count = self.rings[name]
+        start = idx + self.capacity - count
+        return (times[start:idx+self.capacity],
+                data[start:idx+self.capacity])
+
+    def save(self, fileName, attrs={}, resample=None):
+        '''
+        resample(lineouts) returns grid and lineouts on it for lineouts of
+        shape (nPixels, n), e.g. SpectrometerCalibration.resample, they
+        are saved in addition
+        '''
+        import h5py
+        with h5py.File(fileName, 'w') as f:
+            for key, value in attrs.items():
+                f.attrs[key] = value
+            f.attrs['decimation'] = self.decimation
+            f.attrs['time_unit'] = 'ns since epoch (UTC)'
+            for name in self.rings:
+                times, data = self.get(name)
+                group = f.create_group(name.replace(' ', '_'))
+                group.create_dataset('time', data=times)
+                group.create_dataset('lineout', data=data, compression='gzip')
+                if resample is not None:
+                    grid, resampled = resample(data.T)
+                    group.create_dataset('energy', data=grid)
+                    group.create_dataset('lineout_energy',
+                                         data=resampled.T.astype(np.float32),
+                                         compression='gzip')
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Stream rows of a log into an HDF5 file in a background thread
+"""
+
+from guidata.qt.QtCore import (QObject, QThread, Signal)
+
+import time
+from queue import Queue, Empty, Full
+import numpy as np
+import h5py
+
+from Helpers.genericthread import GenericWorker
+
+
+class LogWriter(QObject):
+    '''
+    One HDF5 file per session with one resizable, chunked dataset of a
+    structured dtype. Only new rows are handed over and appended, the file
+    is flushed every flushIntervall seconds. The file is opened in SWMR
+    mode, it can be read while it is written and is consistent up to the
+    last flush if the program dies.
+    Further fixed size datasets (e.g. statistics of the session) are
+    created when the session is opened and overwritten by updateDatasets,
+    SWMR mode does not allow to create them later.
+    '''
+    message = Signal(object)
+    def __init__(self, flushIntervall=10., maxQueue=256):
+        super(LogWriter, self).__init__()
+        self.queue = Queue(maxQueue)
+        self.flushIntervall = flushIntervall # s
+        self.droppedRows = 0 # not written as the queue was full
+        self.drops = 0 # addRows calls which dropped rows
+
+        self.writer_thread = QThread()
+        self.writer_thread.start()
+        self.writer_worker = GenericWorker(self.__writeRows)
+        self.writer_worker.moveToThread(self.writer_thread)
+        self.writer_worker.start.emit()
+
+    def setFlushIntervall(self, seconds):
+        self.flushIntervall = seconds
+
+    def openSession(self, fileName, name, dtype, attrs={}, datasetAttrs={},
+                    extra={}):
+        '''
+        Create file with empty dataset name of given (structured) dtype and
+        the datasets in extra (name: initial array)
+        '''
+        self.droppedRows = 0
+        self.drops = 0
+        self.queue.put(('open', fileName, name, np.dtype(dtype), dict(attrs),
+                        dict(datasetAttrs), dict(extra)))
+
+    def updateDatasets(self, datasets, block=False):
+        '''
+        Overwrite datasets given in extra of openSession (name: array of
+        the same shape). Without block it is skipped if the queue is full,
+        the next update writes them.
+        '''
+        try:
+            self.queue.put(('update', dict(datasets)), block)
+        except Full:
+            pass
+
+    def addRows(self, rows):
+        '''
+        Queue rows (structured array) for appending, they are not copied.
+        Does not block, if the queue is full the rows are dropped and
+        counted. Returns False if dropped.
+        '''
+        if not len(rows):
+            return True
+        try:
+            self.queue.put_nowait(('rows', rows))
+            return True
+        except Full:
+            self.droppedRows += len(rows)
+            self.drops += 1
+            if self.drops % 10 == 1:
+                self.message.emit('{:d} rows not saved, disk too slow'
+                                  .format(self.droppedRows))
+            return False
+
+    def closeSession(self):
+        self.queue.put(('close',))
+
+    def close(self):
+        '''
+        Write queued rows, close file and stop thread
+        '''
+        self.queue.put(('quit',))
+        self.writer_thread.quit()
+        self.writer_thread.wait()
+
+    def __createFile(self, fileName, name, dtype, attrs, datasetAttrs, extra):
+        f = h5py.File(fileName, 'w', libver='latest')
+        for key, value in attrs.items():
+            f.attrs[key] = value
+        dset = f.create_dataset(name, shape=(0,), maxshape=(None,),
+                                dtype=dtype, chunks=(4096,))
+        for key, value in datasetAttrs.items():
+            dset.attrs[key] = value
+        for key, value in extra.items():
+            f.create_dataset(key, data=value)
+        f.swmr_mode = True
+        return f, dset
+
+    def __writeRows(self):
+        '''
+        Function run in thread
+        '''
+        f = None
+        dset = None
+        lastFlush = time.monotonic()
+        while True:
+            try:
+                cmd = self.queue.get(timeout=0.5)
+            except Empty:
+                cmd = ('idle',)
+            try:
+                if cmd[0] == 'rows' and dset is not None:
+                    rows = cmd[1]
+                    n = dset.shape[0]
+                    dset.resize((n + len(rows),))
+                    dset[n:] = rows
+                elif cmd[0] == 'update' and f is not None:
+                    for key, value in cmd[1].items():
+                        f[key][...] = value
+                elif cmd[0] in ('open', 'close', 'quit'):
+                    if f is not None:
+                        self.message.emit('{:s} closed, {:d} rows'.format(
+                            f.filename, dset.shape[0]))
+                        f.close()
+                        f = dset = None
+                    if cmd[0] == 'open':
+                        f, dset = self.__createFile(*cmd[1:])
+                        self.message.emit(f.filename + ' opened')
+                    elif cmd[0] == 'quit':
+                        break
+                if f is not None and \
+                        time.monotonic() - lastFlush > self.flushIntervall:
+                    f.flush()
+                    lastFlush = time.monotonic()
+            except Exception as e:
+                self.message.emit('Error writing log: ' + str(e))
+            finally:
+                if cmd[0] != 'idle':
+                    self.queue.task_done()
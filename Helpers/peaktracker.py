@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Track position, width and intensity of spectral peaks in lineouts
+"""
+
+import numpy as np
+
+
+class PeakTracker:
+    '''
+    Computes integrated intensity, centroid, peak position and FWHM (from
+    the second moment) for all peak windows at once. Moments come from
+    cumulative sums, so every window costs two lookups independent of its
+    width. Results are appended to a preallocated array which doubles its
+    size when full.
+    '''
+    quantities = ['intensity', 'centroid', 'peak', 'fwhm']
+    sigmaToFwhm = 2*np.sqrt(2*np.log(2))
+    def __init__(self, capacity=1024):
+        self.initCapacity = capacity
+        self.setWindows([])
+
+    def setWindows(self, windows):
+        '''
+        Peak windows as list of (first pixel, last pixel), resets history
+        '''
+        windows = np.asarray(windows, dtype=int).reshape(-1, 2)
+        self.lo = windows.min(axis=1)
+        self.hi = windows.max(axis=1) + 1 # exclusive
+        width = (self.hi - self.lo).max() if len(windows) else 0
+        # pixel indices of every window padded to the widest one
+        self.offsets = np.arange(width)
+        self.times = np.zeros(self.initCapacity, dtype=np.int64) # ns
+        self.values = np.zeros((self.initCapacity, len(windows),
+                                len(self.quantities)), dtype=np.float64)
+        self.count = 0
+
+    def numWindows(self):
+        return len(self.lo)
+
+    def compute(self, lineouts):
+        '''
+        Quantities of all windows for lineouts of shape (..., pixel),
+        returns array (..., window, quantity)
+        '''
+        y = np.asarray(lineouts, dtype=np.float64)
+        n = y.shape[-1]
+        lo = np.clip(self.lo, 0, n)
+        hi = np.clip(self.hi, 0, n)
+        x = np.arange(n, dtype=np.float64)
+        # cumulative moments with leading zero
+        pad = [(0, 0)]*(y.ndim-1) + [(1, 0)]
+        s0 = np.pad(np.cumsum(y, axis=-1), pad)
+        s1 = np.pad(np.cumsum(x*y, axis=-1), pad)
+        s2 = np.pad(np.cumsum(x*x*y, axis=-1), pad)
+        m0 = s0[..., hi] - s0[..., lo]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m1 = (s1[..., hi] - s1[..., lo]) / m0
+            var = (s2[..., hi] - s2[..., lo]) / m0 - m1**2
+        # peak position, windows padded to same width and masked
+        idx = lo[:, None] + self.offsets[None, :]
+        valid = idx < hi[:, None]
+        vals = np.where(valid, y[..., np.clip(idx, 0, n-1)], -np.inf)
+        peak = lo + vals.argmax(axis=-1)
+        fwhm = self.sigmaToFwhm*np.sqrt(np.maximum(var, 0))
+        return np.stack((m0, m1, peak, fwhm), axis=-1)
+
+    def add(self, lineout, t):
+        '''
+        Compute quantities for one lineout taken at time t (ns since epoch)
+        and store them
+        '''
+        if self.numWindows() == 0:
+            return
+        if self.count == len(self.times):
+            self.times = np.concatenate((self.times,
+                                         np.zeros_like(self.times)))
+            self.values = np.concatenate((self.values,
+                                          np.zeros_like(self.values)))
+        self.times[self.count] = t
+        self.values[self.count] = self.compute(lineout)
+        self.count += 1
+
+    def get(self, quantity):
+        '''
+        Times and values (time, window) of one quantity, views
+        '''
+        i = self.quantities.index(quantity)
+        return self.times[:self.count], self.values[:self.count,:,i]
+
+    def save(self, fileName, attrs={}):
+        import h5py
+        with h5py.File(fileName, 'w') as f:
+            for key, value in attrs.items():
+                f.attrs[key] = value
+            f.create_dataset('windows', data=np.column_stack((self.lo,
+                                                              self.hi-1)))
+            f.create_dataset('time', data=self.times[:self.count])
+            f['time'].attrs['unit'] = 'ns since epoch (UTC)'
+            for i, quantity in enumerate(self.quantities):
+                f.create_dataset(quantity, data=self.values[:self.count,:,i])
@@ -196,26 +196,154 @@ class SignalFT(ObjectFT):
         ObjectFT.setup(self, toolbar)
 
 
+class TraceFT(ObjectFT):
+    '''
+    Curve of a long trace from a MinMaxPyramid, only the level matching
+    the visible window is handed to the curve. Follows new data as long as
+    the end of the trace is visible.
+    '''
+    def __init__(self, parent, plot, pyramid, col='b', maxPoints=4000):
+        super(TraceFT, self).__init__(parent, plot, col)
+        self.pyramid = pyramid
+        self.maxPoints = maxPoints
+        self.follow = True
+        self.level = 0
+        self.drawing = False
+        self.plot.SIG_PLOT_AXIS_CHANGED.connect(self.__axisChanged)
+
+    def updateTrace(self, tail=None):
+        '''New samples in the pyramid, tail as for MinMaxPyramid.update'''
+        self.pyramid.update(tail)
+        if self.follow:
+            self.__draw(*self.pyramid.xRange())
+            self.drawing = True
+            self.plot.do_autoscale(replot=False)
+            self.drawing = False
+        else:
+            self.__draw(*self.__visible())
+        self.plot.replot()
+
+    def __visible(self):
+        x0, x1 = self.plot.get_axis_limits('bottom')
+        x0, x1 = self.scaleFunInv(x0), self.scaleFunInv(x1)
+        return min(x0, x1), max(x0, x1)
+
+    def __draw(self, xMin, xMax):
+        x, y, self.level = self.pyramid.envelope(xMin, xMax, self.maxPoints)
+        self.curve.set_data(self.scaleFun(x), y)
+
+    def __axisChanged(self, plot):
+        '''
+        Zoom or pan, show matching level of visible window
+        '''
+        if self.drawing:
+            return
+        xMin, xMax = self.__visible()
+        self.follow = xMax >= self.pyramid.xRange()[1]
+        self.drawing = True
+        self.__draw(xMin, xMax)
+        self.plot.replot()
+        self.drawing = False
+
+    def funChanged(self, functions):
+        '''Slot for changing the x axis scale function'''
+        self.scaleFun, self.scaleFunInv = functions
+        self.follow = True
+        self.updateTrace()
+
+
+def downsample(data, mode='mean'):
+    '''
+    Halve image in both directions by mean or max of 2x2 blocks
+    '''
+    h, w = data.shape[0]//2, data.shape[1]//2
+    blocks = data[:2*h,:2*w].reshape(h, 2, w, 2)
+    if mode == 'max':
+        return blocks.max(axis=(1, 3))
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
 class ImageFT(QSplitter):
-    def __init__(self, parent, plot):
+    def __init__(self, parent, plot, pyramidMode='mean'):
         super(ImageFT, self).__init__(Qt.Vertical, parent)
         self.plot = plot
-        self.image = make.image(np.zeros((512, 2048)))
+        # camera counts are unsigned 16 bit, keep them like this for display
+        self.image = make.image(np.zeros((512, 2048), dtype=np.uint16))
         self.plot.add_item(self.image)
+        # title as label, setTitle() would trigger a new layout of the plot
+        self.title = make.label('', 'TL', (0, 0), 'TL')
+        self.plot.add_item(self.title)
         
         self.hCursor = None
         self.roi = None
 
+        # level k is the image downsampled by 2**k, only the level matching
+        # the zoom and size of the plot is handed to the image item
+        self.pyramid = []
+        self.pyramidMode = pyramidMode # 'mean' or 'max'
+        self.level = 0
+
         self.scaleFun = lambda x: x
         self.scaleFunInv = lambda x: x
 
+        self.plot.SIG_PLOT_AXIS_CHANGED.connect(self.__axisChanged)
+
     #@Slot(object)
     def updatePlot(self, data, title=''):
         '''New data arrived and thus update the plot'''
-        self.image.set_data(data)
-        self.plot.setTitle(title)
+        resized = not self.pyramid or data.shape != self.pyramid[0].shape
+        self.pyramid = [data]
+        self.title.set_text(title)
+        if resized: # e.g. binning changed
+            self.__setLevel(0)
+            self.plot.do_autoscale(replot=False)
+        self.__setLevel(self.__chooseLevel())
         self.plot.replot()
 
+    def getLevel(self, level):
+        '''
+        Return level of pyramid, missing levels are computed from the
+        next finer one
+        '''
+        while len(self.pyramid) <= level:
+            self.pyramid.append(downsample(self.pyramid[-1], self.pyramidMode))
+        return self.pyramid[level]
+
+    def __chooseLevel(self):
+        '''
+        Coarsest level which has still one pixel per pixel on screen
+        '''
+        x0, x1 = self.plot.get_axis_limits('bottom')
+        y0, y1 = self.plot.get_axis_limits('left')
+        canvas = self.plot.canvas()
+        scale = min(abs(x1-x0)/max(canvas.width(), 1),
+                    abs(y1-y0)/max(canvas.height(), 1))
+        level = int(np.floor(np.log2(max(scale, 1))))
+        # keep at least a few pixel in each direction
+        maxLevel = int(np.log2(max(min(self.pyramid[0].shape), 1))) - 2
+        return max(0, min(level, maxLevel))
+
+    def __setLevel(self, level):
+        data = self.getLevel(level)
+        # lut range from a coarse level, no need to scan the full image
+        lutData = self.getLevel(max(level, 1)) if min(data.shape) > 1 else data
+        self.image.set_data(data, lut_range=(lutData.min(), lutData.max()))
+        # keep coordinates in pixels of the full image
+        self.image.set_xdata(0, data.shape[1]*2**level)
+        self.image.set_ydata(0, data.shape[0]*2**level)
+        self.level = level
+
+    def __axisChanged(self, plot):
+        '''
+        Zoom or pan changed, show matching level
+        '''
+        if not self.pyramid:
+            return
+        level = self.__chooseLevel()
+        if level != self.level:
+            self.__setLevel(level)
+            self.plot.replot()
+
     def getData(self, fun):
         pass
         #x, y = self.curve.get_data()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Multi resolution min/max/mean levels of long traces
+"""
+
+import numpy as np
+
+from Helpers.columnstore import ColumnStore
+
+
+class MinMaxPyramid:
+    '''
+    Level k holds min, max and mean of blocks of factor**k samples of a
+    trace kept in a ColumnStore. Levels are updated incrementally from the
+    new rows only, samples which do not fill a block yet wait in a short
+    pending buffer, so the cost is amortized O(1) per sample.
+    '''
+    def __init__(self, store, xName, yName, factor=10, numLevels=5):
+        self.store = store # raw trace, level 0
+        self.xName = xName
+        self.yName = yName
+        self.factor = factor
+        self.numLevels = numLevels
+        self.clear()
+
+    def clear(self):
+        self.levels = [None] + [ColumnStore([('x', np.float64),
+                                             ('min', np.float64),
+                                             ('max', np.float64),
+                                             ('mean', np.float64)], 4096)
+                                for k in range(self.numLevels)]
+        # inputs of level k which do not fill a block yet
+        self.pending = [None] + [{'x': np.zeros(0), 'min': np.zeros(0),
+                                  'max': np.zeros(0), 'mean': np.zeros(0)}
+                                 for k in range(self.numLevels)]
+        self.done = 0 # rows of store already added
+
+    def update(self, tail=None):
+        '''
+        Add rows which were appended to the store since last call. tail
+        (column name: new rows, e.g. ColumnStore.tail) is used directly if
+        it holds exactly these rows, else they are read from the store.
+        '''
+        count = len(self.store)
+        if count < self.done: # store was cleared
+            self.clear()
+        if tail is not None and self.done + len(tail[self.xName]) == count:
+            x, y = tail[self.xName], tail[self.yName]
+        else:
+            x = self.store.column(self.xName, self.done, count)
+            y = self.store.column(self.yName, self.done, count)
+        self.done = count
+        self.__addLevel(1, {'x': x, 'min': y, 'max': y, 'mean': y})
+
+    def __addLevel(self, k, new):
+        if k > self.numLevels or len(new['x']) == 0:
+            return
+        pending = self.pending[k]
+        data = {name: np.concatenate((pending[name], new[name]))
+                for name in pending}
+        n = len(data['x']) // self.factor * self.factor
+        self.pending[k] = {name: value[n:] for name, value in data.items()}
+        if n == 0:
+            return
+        blocks = {name: value[:n].reshape(-1, self.factor)
+                  for name, value in data.items()}
+        block = {'x': blocks['x'].mean(axis=1),
+                 'min': blocks['min'].min(axis=1),
+                 'max': blocks['max'].max(axis=1),
+                 'mean': blocks['mean'].mean(axis=1)}
+        self.levels[k].append(**block)
+        self.__addLevel(k+1, block)
+
+    def xRange(self):
+        x = self.store.column(self.xName, 0, self.done)
+        if len(x) == 0:
+            return 0., 1.
+        return x[0], x[-1]
+
+    def chooseLevel(self, xMin, xMax, maxPoints=4000):
+        '''
+        Finest level with at most maxPoints points (min and max count as
+        two) in the window
+        '''
+        x = self.store.column(self.xName, 0, self.done)
+        nRaw = np.searchsorted(x, xMax, 'right') - np.searchsorted(x, xMin)
+        n = nRaw
+        level = 0
+        while n > maxPoints and level < self.numLevels and \
+                len(self.levels[level+1]) > 1:
+            level += 1
+            # blocks of factor**level raw points, min and max each
+            n = 2 * nRaw // self.factor**level
+        return level
+
+    def envelope(self, xMin, xMax, maxPoints=4000):
+        '''
+        x and y of the level matching the window, with one window width of
+        margin on each side for panning. Levels > 0 alternate min and max
+        of every block. Returns x, y and level.
+        '''
+        level = self.chooseLevel(xMin, xMax, maxPoints)
+        margin = xMax - xMin
+        if level == 0:
+            x = self.store.column(self.xName, 0, self.done)
+            y = self.store.column(self.yName, 0, self.done)
+        else:
+            store = self.levels[level]
+            count = len(store)
+            x = store.column('x', 0, count)
+        lo = np.searchsorted(x, xMin - margin)
+        hi = np.searchsorted(x, xMax + margin, 'right')
+        if level == 0:
+            return x[lo:hi], y[lo:hi], level
+        yMin = store.column('min', lo, hi)
+        yMax = store.column('max', lo, hi)
+        return (np.repeat(x[lo:hi], 2),
+                np.column_stack((yMin, yMax)).ravel(), level)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Run instrument loops and other work as cancellable tasks in threads
+"""
+
+from guidata.qt.QtCore import (QObject, QThread, Signal)
+
+import time
+import threading
+import traceback
+from queue import Queue
+from collections import deque
+
+from Helpers.genericthread import GenericWorker
+
+
+class Cancelled(Exception):
+    '''
+    Raised by CancelToken.check(), ends a task as cancelled
+    '''
+
+
+class CancelToken:
+    '''
+    Cooperative cancellation, the task asks the token regularly and waits
+    on it instead of sleeping, so it stops within milliseconds
+    '''
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled()
+
+    def wait(self, seconds):
+        '''
+        Sleep up to seconds, returns True if cancelled meanwhile
+        '''
+        return self.event.wait(seconds)
+
+
+class Task:
+    '''
+    Future of a function fun(token, *args, **kwargs) run by a Scheduler.
+    Times are time.perf_counter() seconds, e.g. for measuring how long
+    tasks wait and run.
+    '''
+    def __init__(self, fun, args, kwargs, name=None):
+        self.fun = fun
+        self.args = args
+        self.kwargs = kwargs
+        self.name = name or getattr(fun, '__name__', 'task')
+        self.token = CancelToken()
+        self.state = 'pending' # running, done, cancelled or failed
+        self.value = None
+        self.error = None
+        self.callbacks = []
+        self.finishedEvent = threading.Event()
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+
+    def run(self):
+        if self.token.cancelled():
+            self.state = 'cancelled'
+        else:
+            self.started = time.perf_counter()
+            self.state = 'running'
+            try:
+                self.value = self.fun(self.token, *self.args, **self.kwargs)
+                self.state = 'cancelled' if self.token.cancelled() else 'done'
+            except Cancelled:
+                self.state = 'cancelled'
+            except Exception as e:
+                self.error = e
+                self.traceback = traceback.format_exc()
+                self.state = 'failed'
+        self.finished = time.perf_counter()
+        self.finishedEvent.set()
+
+    def cancel(self):
+        '''
+        Ask task to stop, a pending task will not start
+        '''
+        self.token.cancel()
+
+    def done(self):
+        return self.finishedEvent.is_set()
+
+    def wait(self, timeout=None):
+        '''
+        Block until finished, not to be used in the gui thread
+        '''
+        return self.finishedEvent.wait(timeout)
+
+    def result(self, timeout=None):
+        '''
+        Return value of fun, raises its exception if it failed
+        '''
+        if not self.wait(timeout):
+            raise TimeoutError(self.name + ' not finished')
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def addDoneCallback(self, fun):
+        '''
+        fun(task) is called in the gui thread when the task is finished,
+        to be called from the gui thread
+        '''
+        if self.done():
+            fun(self)
+        else:
+            self.callbacks.append(fun)
+
+    def waitTime(self):
+        '''
+        Seconds between submit and start
+        '''
+        return (self.started or self.finished or time.perf_counter()) - \
+            self.submitted
+
+    def runTime(self):
+        if self.started is None:
+            return 0.
+        return (self.finished or time.perf_counter()) - self.started
+
+
+class Lane:
+    '''
+    Thread running the tasks of one lane one after another
+    '''
+    def __init__(self, scheduler, name):
+        self.name = name
+        self.queue = Queue()
+        self.current = None
+        self.pending = [] # submitted, not started yet
+        self.thread = QThread()
+        self.thread.start()
+        self.worker = GenericWorker(scheduler._runLane, self)
+        self.worker.moveToThread(self.thread)
+        self.worker.start.emit()
+
+
+class Scheduler(QObject):
+    '''
+    Tasks are submitted to named lanes. Tasks of one lane run one after
+    another in the thread of the lane, e.g. all tasks using the same
+    device, different lanes run in parallel. Cancelling the running task
+    and submitting the next one does not wait, the next task starts as
+    soon as the running one returned. Done callbacks and the taskFinished
+    signal are delivered in the gui thread. Finished tasks are kept in
+    history for their timing.
+    '''
+    taskFinished = Signal(object)
+    def __init__(self, historyLength=100):
+        super(Scheduler, self).__init__()
+        self.lanes = {}
+        self.lock = threading.Lock()
+        self.history = deque(maxlen=historyLength)
+        self.taskFinished.connect(self.__finished)
+
+    def submit(self, fun, *args, name=None, lane='default',
+               cancelRunning=False, onDone=None, **kwargs):
+        '''
+        Run fun(token, *args, **kwargs) in lane and return its Task.
+        cancelRunning cancels the running and pending tasks of the lane
+        first.
+        '''
+        task = Task(fun, args, kwargs, name)
+        if onDone is not None:
+            task.callbacks.append(onDone)
+        with self.lock:
+            if lane not in self.lanes:
+                self.lanes[lane] = Lane(self, lane)
+            if cancelRunning:
+                self.__cancelLane(self.lanes[lane])
+            self.lanes[lane].pending.append(task)
+        self.lanes[lane].queue.put(task)
+        return task
+
+    def cancel(self, lane='default'):
+        '''
+        Cancel running and pending tasks of lane, does not wait
+        '''
+        with self.lock:
+            if lane in self.lanes:
+                self.__cancelLane(self.lanes[lane])
+
+    def __cancelLane(self, lane):
+        if lane.current is not None:
+            lane.current.cancel()
+        for task in lane.pending:
+            task.cancel()
+
+    def running(self, lane='default'):
+        '''
+        Task currently running in lane or None
+        '''
+        with self.lock:
+            return self.lanes[lane].current if lane in self.lanes else None
+
+    def close(self, timeout=5.):
+        '''
+        Cancel all tasks and stop the threads, waits up to timeout s per
+        lane for the running task to return, timeout None waits until it
+        returned. Returns False if a lane did not finish in time.
+        '''
+        with self.lock:
+            lanes = list(self.lanes.values())
+            self.lanes = {}
+        for lane in lanes:
+            self.__cancelLane(lane)
+            lane.queue.put(None)
+        finished = True
+        for lane in lanes:
+            lane.thread.quit()
+            if timeout is None:
+                lane.thread.wait()
+            else:
+                finished &= lane.thread.wait(int(timeout*1000))
+        return finished
+
+    def _runLane(self, lane):
+        '''
+        Function run in thread of lane
+        '''
+        while True:
+            task = lane.queue.get()
+            if task is None:
+                break
+            with self.lock:
+                lane.pending.remove(task)
+                lane.current = task
+            task.run()
+            with self.lock:
+                lane.current = None
+            self.taskFinished.emit(task)
+
+    def __finished(self, task):
+        '''
+        In gui thread
+        '''
+        self.history.append(task)
+        if task.state == 'failed' and not task.callbacks:
+            print(task.name, 'failed:\n', task.traceback)
+        callbacks, task.callbacks = task.callbacks, []
+        for fun in callbacks:
+            fun(task)
+
+    def timing(self):
+        '''
+        Name, state, wait and run time in s of the finished tasks
+        '''
+        return [(task.name, task.state, task.waitTime(), task.runTime())
+                for task in self.history]
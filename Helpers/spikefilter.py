@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Hot pixel and cosmic ray rejection for camera frames
+"""
+
+import numpy as np
+
+
+def med3(a, b, c):
+    '''
+    Element wise median of three arrays
+    '''
+    return np.maximum(np.minimum(a, b), np.minimum(np.maximum(a, b), c))
+
+
+class SpikeFilter:
+    '''
+    Detects single pixel spikes either against a local median (separable
+    3x1 and 1x3 median) or against the median of the previous frames kept
+    in a ring buffer, and replaces them by that median.
+    Pixels which are flagged in more than hotFraction of the frames are
+    learned as hot pixels. They are replaced by the median of their four
+    neighbours before detection, which costs only O(number of hot pixels).
+    '''
+    modes = ['off', 'spatial', 'temporal']
+    def __init__(self, nSigma=5., ringLen=3, hotFraction=0.5, learnFrames=20,
+                 numBuffers=3):
+        self.nSigma = nSigma
+        self.ringLen = ringLen
+        self.hotFraction = hotFraction
+        self.learnFrames = learnFrames # update hot pixel mask every n frames
+        self.numBuffers = numBuffers
+        self.shape = None
+        self.numSpikes = 0 # spikes found in last frame
+
+    def setSigma(self, nSigma):
+        self.nSigma = nSigma
+
+    def reset(self):
+        '''
+        Forget hot pixels and previous frames
+        '''
+        self.shape = None
+
+    def __alloc(self, shape, dtype):
+        self.shape = shape
+        self.bufferPool = [np.empty(shape, dtype=dtype)
+                           for i in range(self.numBuffers)]
+        self.bufferIdx = 0
+        self.ring = np.zeros((self.ringLen,) + shape, dtype=np.float32)
+        self.ringIdx = 0
+        self.ringCount = 0
+        self.flagCount = np.zeros(shape, dtype=np.uint32)
+        self.numFrames = 0
+        self.hotIdx = np.array([], dtype=np.intp) # flat indices
+        self.hotNeighbours = np.zeros((0, 4), dtype=np.intp)
+
+    def __nextBuffer(self):
+        buf = self.bufferPool[self.bufferIdx]
+        self.bufferIdx = (self.bufferIdx + 1) % self.numBuffers
+        return buf
+
+    @staticmethod
+    def localMedian(frame):
+        '''
+        Separable approximation of 3x3 median filter
+        '''
+        p = np.pad(frame.astype(np.float32), 1, mode='edge')
+        cols = med3(p[:-2,:], p[1:-1,:], p[2:,:])
+        return med3(cols[:,:-2], cols[:,1:-1], cols[:,2:])
+
+    def __updateHotPixels(self):
+        self.hotIdx = np.flatnonzero(
+            self.flagCount > self.hotFraction*self.numFrames)
+        ny, nx = self.shape
+        y, x = np.unravel_index(self.hotIdx, self.shape)
+        self.hotNeighbours = np.column_stack((
+            np.ravel_multi_index((np.clip(y-1, 0, ny-1), x), self.shape),
+            np.ravel_multi_index((np.clip(y+1, 0, ny-1), x), self.shape),
+            np.ravel_multi_index((y, np.clip(x-1, 0, nx-1)), self.shape),
+            np.ravel_multi_index((y, np.clip(x+1, 0, nx-1)), self.shape)))
+
+    def numHotPixels(self):
+        return 0 if self.shape is None else self.hotIdx.size
+
+    def apply(self, frame, mode='spatial'):
+        '''
+        Return filtered copy of frame, frame itself is not changed
+        '''
+        if mode == 'off':
+            return frame
+        if self.shape != frame.shape or self.bufferPool[0].dtype != frame.dtype:
+            self.__alloc(frame.shape, frame.dtype)
+        out = self.__nextBuffer()
+        out[...] = frame
+
+        # known hot pixels, O(number of hot pixels)
+        if self.hotIdx.size:
+            flat = out.reshape(-1)
+            flat[self.hotIdx] = np.median(flat[self.hotNeighbours], axis=1)
+            # keep them counted, they are not detected anymore
+            self.flagCount.reshape(-1)[self.hotIdx] += 1
+
+        if mode == 'temporal':
+            if self.ringCount < 2:
+                ref = None
+            elif self.ringCount == 3:
+                ref = med3(self.ring[0], self.ring[1], self.ring[2])
+            else:
+                ref = np.median(self.ring[:self.ringCount], axis=0)
+            self.ring[self.ringIdx] = out
+            self.ringIdx = (self.ringIdx + 1) % self.ringLen
+            self.ringCount = min(self.ringCount + 1, self.ringLen)
+            if ref is None:
+                return out
+        else:
+            ref = self.localMedian(out)
+
+        # only positive spikes, noise from median absolute deviation
+        resid = out - ref
+        sigma = 1.4826*np.median(np.abs(resid[::4,::4])) + 1e-6
+        spikes = resid > self.nSigma*sigma
+        self.numSpikes = int(np.count_nonzero(spikes))
+        np.copyto(out, ref, where=spikes, casting='unsafe')
+
+        # learn hot pixels
+        self.flagCount += spikes
+        self.numFrames += 1
+        if self.numFrames % self.learnFrames == 0:
+            self.__updateHotPixels()
+        return out
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming statistics of a log: rolling windows and Allan deviation
+"""
+
+import numpy as np
+
+
+class MinMaxTree:
+    '''
+    Segment tree of min and max over a ring buffer of size (power of 2),
+    O(log size) per written value and per query
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.mins = np.full(2*self.size, np.inf)
+        self.maxs = np.full(2*self.size, -np.inf)
+
+    def set(self, positions, values):
+        '''
+        Write values at ring positions (no duplicates) and update parents
+        '''
+        idx = positions + self.size
+        self.mins[idx] = values
+        self.maxs[idx] = values
+        idx = np.unique(idx >> 1)
+        while idx[0] > 0:
+            self.mins[idx] = np.minimum(self.mins[2*idx], self.mins[2*idx+1])
+            self.maxs[idx] = np.maximum(self.maxs[2*idx], self.maxs[2*idx+1])
+            idx = np.unique(idx >> 1)
+
+    def query(self, lo, hi):
+        '''
+        Min and max of positions lo..hi-1 (not wrapped)
+        '''
+        mn, mx = np.inf, -np.inf
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                mn = min(mn, self.mins[lo])
+                mx = max(mx, self.maxs[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                mn = min(mn, self.mins[hi])
+                mx = max(mx, self.maxs[hi])
+            lo >>= 1
+            hi >>= 1
+        return mn, mx
+
+
+class StreamStats:
+    '''
+    Rolling mean, std, min, max and relative rms noise (std/mean) over the
+    last N samples for every N in windows, and overlapping Allan deviation
+    at octave spaced averaging times m = 1, 2, 4, ... samples.
+    Samples are added in batches. Window sums are updated with the values
+    entering and leaving (O(1) per sample), min and max come from a segment
+    tree (O(log N)), every octave of the Allan deviation adds one term per
+    sample (O(log N)). Memory is constant, the history is a ring buffer of
+    the longest window and of the longest averaging time.
+    '''
+    quantities = ['count', 'mean', 'std', 'min', 'max', 'rms_noise']
+    def __init__(self, windows=(10, 100, 1000, 10000), numOctaves=16):
+        self.windows = sorted(windows)
+        self.numOctaves = numOctaves
+        self.octaves = 2**np.arange(numOctaves) # averaging times in samples
+        # ring of samples, twice the longest window so a chunk never
+        # overwrites values still leaving a window
+        self.ringSize = 1 << int(np.ceil(np.log2(2*self.windows[-1])))
+        self.chunkSize = self.ringSize // 2
+        # integrated samples, the last 2*m + 1 are needed per octave
+        self.lag = 2*self.octaves[-1]
+        self.tree = MinMaxTree(self.ringSize)
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.ref = None # first value, subtracted against cancellation
+        self.firstTime = self.lastTime = None
+        self.ring = np.zeros(self.ringSize)
+        self.tree.clear()
+        self.sums = np.zeros(len(self.windows)) # of value - ref
+        self.sumSqs = np.zeros(len(self.windows))
+        self.total = 0. # of value - ref, all samples
+        self.sinceExact = 0
+        # phase X_i = sum of the first i samples, X_0 = 0
+        self.phase = np.zeros(2*(self.lag + 1) + self.chunkSize)
+        self.phaseFill = 1
+        self.phaseStart = 0 # index i of phase[0]
+        self.allanSums = np.zeros(self.numOctaves)
+        self.allanTerms = np.zeros(self.numOctaves, dtype=np.int64)
+
+    def add(self, times, values):
+        '''
+        Append a batch of samples, times in ns
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        if self.ref is None:
+            self.ref = values[0]
+            self.firstTime = times[0]
+        self.lastTime = times[-1]
+        for start in range(0, len(values), self.chunkSize):
+            self.__addChunk(values[start:start+self.chunkSize] - self.ref)
+
+    def __addChunk(self, y):
+        n = len(y)
+        c = self.count
+        positions = np.arange(c, c+n) % self.ringSize
+        self.ring[positions] = y
+        self.tree.set(positions, y)
+        newSum = y.sum()
+        newSumSq = np.dot(y, y)
+        self.total += newSum
+        for k, N in enumerate(self.windows):
+            # samples c-N .. c+n-N-1 leave the window
+            leaving = np.arange(max(c-N, 0), max(c+n-N, 0)) % self.ringSize
+            old = self.ring[leaving]
+            self.sums[k] += newSum - old.sum()
+            self.sumSqs[k] += newSumSq - np.dot(old, old)
+        self.count = c + n
+        self.sinceExact += n
+        if self.sinceExact >= self.ringSize:
+            # sums drift by rounding, recompute them now and then
+            self.sinceExact = 0
+            for k, N in enumerate(self.windows):
+                old = self.ring[np.arange(self.count - min(N, self.count),
+                                          self.count) % self.ringSize]
+                self.sums[k] = old.sum()
+                self.sumSqs[k] = np.dot(old, old)
+        self.__addPhase(y)
+
+    def __addPhase(self, y):
+        n = len(y)
+        if self.phaseFill + n > len(self.phase):
+            # move the still needed tail to the front, amortized O(1)
+            keep = min(self.lag + 1, self.phaseFill)
+            self.phase[:keep] = self.phase[self.phaseFill-keep:self.phaseFill]
+            self.phaseStart += self.phaseFill - keep
+            self.phaseFill = keep
+        f = self.phaseFill
+        self.phase[f:f+n] = self.phase[f-1] + np.cumsum(y)
+        self.phaseFill = f + n
+        # new phase indices i, terms X_i - 2 X_(i-m) + X_(i-2m) with i-2m >= 0
+        first = self.phaseStart + f
+        for k, m in enumerate(self.octaves):
+            lo = max(first, 2*m)
+            if lo >= first + n:
+                break
+            i = np.arange(lo, first + n) - self.phaseStart
+            d = self.phase[i] - 2*self.phase[i-m] + self.phase[i-2*m]
+            self.allanSums[k] += np.dot(d, d)
+            self.allanTerms[k] += len(d)
+
+    def sampleTime(self):
+        '''
+        Mean time between samples in s
+        '''
+        if self.count < 2:
+            return np.nan
+        return (self.lastTime - self.firstTime)*1e-9/(self.count - 1)
+
+    def rolling(self):
+        '''
+        Statistics of every window as structured array, windows not filled
+        yet use the available samples
+        '''
+        stats = np.zeros(len(self.windows), dtype=[('window', np.int64)] +
+                         [(q, np.float64) for q in self.quantities])
+        stats['window'] = self.windows
+        for k, N in enumerate(self.windows):
+            n = min(N, self.count)
+            stats['count'][k] = n
+            if n == 0:
+                for q in self.quantities[1:]:
+                    stats[q][k] = np.nan
+                continue
+            mean = self.sums[k]/n
+            var = max(self.sumSqs[k]/n - mean**2, 0.)*n/max(n-1, 1)
+            lo = (self.count - n) % self.ringSize
+            hi = self.count % self.ringSize or self.ringSize
+            if lo < hi:
+                mn, mx = self.tree.query(lo, hi)
+            else:
+                mn1, mx1 = self.tree.query(lo, self.ringSize)
+                mn2, mx2 = self.tree.query(0, hi)
+                mn, mx = min(mn1, mn2), max(mx1, mx2)
+            stats['mean'][k] = mean + self.ref
+            stats['std'][k] = np.sqrt(var)
+            stats['min'][k] = mn + self.ref
+            stats['max'][k] = mx + self.ref
+            stats['rms_noise'][k] = np.sqrt(var)/abs(mean + self.ref)
+        return stats
+
+    def allan(self):
+        '''
+        Overlapping Allan deviation as structured array: averaging time in
+        samples and s, deviation (absolute and relative to the mean) and
+        number of terms
+        '''
+        allan = np.zeros(self.numOctaves, dtype=[('m', np.int64),
+                                                 ('tau', np.float64),
+                                                 ('adev', np.float64),
+                                                 ('adev_rel', np.float64),
+                                                 ('terms', np.int64)])
+        allan['m'] = self.octaves
+        allan['tau'] = self.octaves*self.sampleTime()
+        allan['terms'] = self.allanTerms
+        with np.errstate(invalid='ignore', divide='ignore'):
+            allan['adev'] = np.sqrt(self.allanSums /
+                (2.*self.octaves**2*self.allanTerms))
+            mean = self.total/self.count + self.ref if self.count else np.nan
+            allan['adev_rel'] = allan['adev']/abs(mean)
+        return allan
+
+    def datasets(self):
+        '''
+        Name and data of the statistics for saving with the log
+        '''
+        return {'rolling_stats': self.rolling(), 'allan': self.allan()}
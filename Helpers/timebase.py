@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Common time base for time stamps of several instruments
+
+Time stamps are int64 nanoseconds since epoch (UTC), the functions below
+convert arrays of them for display and export.
+"""
+
+import time
+import datetime
+import threading
+import numpy as np
+
+
+class TimeBase:
+    '''
+    Monotonic counter plus an offset to the wall clock. All instruments
+    sharing one instance get time stamps on the same monotonic axis, so
+    they can be correlated. The offset follows the wall clock (e.g. NTP
+    corrections) slowly, at most maxSlew seconds per second, so time stamps
+    never jump or run backwards.
+    '''
+    def __init__(self, resyncIntervall=10., maxSlew=500e-6):
+        self.resyncIntervall = int(resyncIntervall*1e9) # ns
+        self.maxSlew = maxSlew
+        self.lock = threading.Lock()
+        counter = time.perf_counter_ns()
+        self.offset = time.time_ns() - counter
+        self.lastSync = counter
+        self.last = 0 # last time stamp handed out
+
+    def nanoseconds(self):
+        '''
+        Nanoseconds since epoch, strictly increasing
+        '''
+        with self.lock:
+            counter = time.perf_counter_ns()
+            elapsed = counter - self.lastSync
+            if elapsed > self.resyncIntervall:
+                error = time.time_ns() - counter - self.offset
+                step = int(self.maxSlew*elapsed)
+                self.offset += max(-step, min(step, error))
+                self.lastSync = counter
+            self.last = max(counter + self.offset, self.last + 1)
+            return self.last
+
+    def seconds(self):
+        '''
+        Seconds since epoch
+        '''
+        return self.nanoseconds()*1e-9
+
+    def now(self):
+        return toDatetime(self.nanoseconds())
+
+
+def toDatetime64(ns):
+    '''
+    numpy datetime64[ns] (UTC) of time stamps
+    '''
+    return np.asarray(ns, dtype=np.int64).astype('datetime64[ns]')
+
+def localOffset():
+    '''
+    Offset of local time to UTC in ns
+    '''
+    return int(datetime.datetime.now().astimezone().utcoffset(
+        ).total_seconds()*1e9)
+
+def toIso(ns, local=True, unit='us'):
+    '''
+    ISO 8601 strings of time stamps, in local time like
+    datetime.isoformat() or in UTC
+    '''
+    ns = np.asarray(ns, dtype=np.int64)
+    if local:
+        ns = ns + localOffset()
+    return np.datetime_as_string(ns.astype('datetime64[ns]'), unit=unit)
+
+def toSeconds(ns, start=0):
+    '''
+    Float seconds since start (ns), for plotting
+    '''
+    return (np.asarray(ns, dtype=np.int64) - start)*1e-9
+
+def toDatetime(ns):
+    '''
+    Local datetime of one time stamp, e.g. for file names
+    '''
+    return datetime.datetime.fromtimestamp(ns // 1000 * 1e-6)
+
+
+# shared by all instruments of one process
+timeBase = TimeBase()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Local fake of the Maestro TCP stream, for tests and throughput benchmarks
+
+    python -m Instruments.fakemaestro --port 5000 --rate 10
+    python -m Instruments.fakemaestro --benchmark --meters 4 --rate 100000
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+import numpy as np
+
+
+class FakeMaestro:
+    '''
+    Sends rate values per second (normal distributed around mean) to every
+    client after 'start\\n' until 'stop\\n'. Writes wait for the socket
+    buffer to drain, so a slow client slows the stream down like the real
+    meter does.
+    '''
+    def __init__(self, host='127.0.0.1', port=5000, rate=10., mean=1e-3,
+                 noise=1e-5, seed=None):
+        self.host = host
+        self.port = port # 0 picks a free port, set after start()
+        self.rate = rate
+        self.mean = mean
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.server = None
+        self.sent = 0 # values sent to all clients
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.__client, self.host,
+                                                 self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __client(self, reader, writer):
+        streaming = [False]
+        streamer = asyncio.ensure_future(self.__stream(writer, streaming))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.strip()
+                if command == b'start':
+                    streaming[0] = True
+                elif command == b'stop':
+                    streaming[0] = False
+        except OSError:
+            pass
+        finally:
+            streamer.cancel()
+            writer.close()
+
+    async def __stream(self, writer, streaming, interval=0.01):
+        due = 0. # values due but not sent yet
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            if not streaming[0]:
+                last = now
+                due = 0.
+                continue
+            due += (now - last)*self.rate
+            last = now
+            n = int(due)
+            if n == 0:
+                continue
+            due -= n
+            values = self.rng.normal(self.mean, self.noise, n)
+            writer.write(('\n'.join('{:.6e}'.format(v) for v in values) +
+                          '\n').encode())
+            self.sent += n
+            try:
+                await writer.drain()
+            except OSError:
+                return
+
+
+def benchmark(numMeters=4, rate=100000., duration=5.):
+    '''
+    numMeters fake meters and one client in this process, prints the
+    received samples per second
+    '''
+    from Instruments.maestro import MaestroClient
+
+    loop = asyncio.new_event_loop()
+    servers = [FakeMaestro(port=0, rate=rate, seed=i) for i in range(numMeters)]
+    for server in servers:
+        loop.run_until_complete(server.start())
+    serverThread = threading.Thread(target=loop.run_forever, daemon=True)
+    serverThread.start()
+
+    received = dict.fromkeys(range(numMeters), 0)
+    def onBatch(name, times, values):
+        received[name] += len(values)
+        client.ack(name)
+    client = MaestroClient(onBatch)
+    for i, server in enumerate(servers):
+        client.addMeter(i, server.host, server.port)
+        client.start(i)
+    time.sleep(duration)
+    client.close()
+    loop.call_soon_threadsafe(loop.stop)
+    serverThread.join()
+
+    total = sum(received.values())
+    print('{:d} meters, {:.0f} values/s requested each'.format(numMeters, rate))
+    for i in range(numMeters):
+        print('meter {:d}: {:.0f} values/s received, {:d} dropped'.format(
+            i, received[i]/duration, client.dropped(i)))
+    print('total: {:.0f} values/s'.format(total/duration))
+    return total/duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=10.,
+                        help='values per second')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--meters', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.)
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.meters, args.rate, args.duration)
+        return
+    loop = asyncio.new_event_loop()
+    server = FakeMaestro(args.host, args.port, args.rate)
+    loop.run_until_complete(server.start())
+    print('Fake Maestro on {:s}:{:d}'.format(args.host, server.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
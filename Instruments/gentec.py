@@ -1,34 +1,42 @@
 # -*- coding: utf-8 -*-
 
-from PyQt5 import QtNetwork
 from guidata.qt.QtGui import (QSplitter, QGridLayout, QLineEdit,
                               QWidget, QSpinBox, QIntValidator,
                               QPushButton, QRegExpValidator,
-                              QLabel, QMessageBox)
-from guidata.qt.QtCore import (QThread, Qt, Signal, QRegExp)
+                              QLabel, QMessageBox, QCheckBox)
+from guidata.qt.QtCore import (Qt, Signal, QRegExp)
 
 import numpy as np
-import time
-from datetime import datetime
-from queue import Queue
 
-from Helpers.genericthread import GenericWorker
+from Helpers.columnstore import ColumnStore
+from Helpers.histogram import AutoHistogram
+from Helpers.timebase import timeBase, toSeconds
+from Instruments.maestro import MaestroClient
+
 
 class MaestroUi(QSplitter):
     connected = Signal() # gets emitted if stage was sucessfully connected
-    newPlotData = Signal(object)
-    updateAvgTxt = Signal(object)
-    def __init__(self, parent):
+    newPlotData = Signal(object) # views of the new rows of measureData
+    newBatch = Signal(object, object, object) # from the client thread
+    stateChanged = Signal(object, object)
+    def __init__(self, parent, client=None, name='maestro'):
+        '''
+        Several MaestroUi can share one client (one event loop for all
+        meters), each with its own name
+        '''
         #super(ObjectFT, self).__init__(Qt.Vertical, parent)
         super().__init__(parent)
 
-        self.meter = None
-        self.collectData = True # bool for data collection thread
-        self.avgData = Queue() # need data for averaging and set for holding all
+        self.name = name
         self.measure = False
-        self.runDataThr = True
-        self.measureData = []
+        # time stamp in ns since epoch, seconds since start, power
+        self.measureData = ColumnStore([('time', np.int64),
+                                        ('seconds', np.float64),
+                                        ('power', np.float64)])
         self.startTime = None
+        self.pending = np.zeros(0) # samples not averaged yet
+        # shot to shot distribution in energy mode, all received samples
+        self.histogram = AutoHistogram()
 
 
         layoutWidget = QWidget()
@@ -45,12 +53,15 @@ class MaestroUi(QSplitter):
         self.portEdit.setValidator(QIntValidator(1, 65535, self))
         self.portEdit.setText('5000')
         self.connectBtn = QPushButton('Connect')
+        self.stateLabel = QLabel('not connected')
         self.avgSpin = QSpinBox()
         self.avgSpin.setValue(1)
         self.avgSpin.setRange(1, 10000)
         self.currValDisp = QLabel('0.0')
         self.startMeasBtn = QPushButton('Start aq')
         self.stopMeasBtn  = QPushButton('Stop aq')
+        self.histCheck = QCheckBox('Energy histogram')
+        self.histResetBtn = QPushButton('Reset histogram')
 
         ##############
         # put layout together
@@ -58,98 +69,93 @@ class MaestroUi(QSplitter):
         layout.addWidget(self.ipEdit, 1, 0)
         layout.addWidget(QLabel('Port:'), 0, 1)
         layout.addWidget(self.portEdit, 1, 1)
+        layout.addWidget(self.stateLabel, 2, 0)
         layout.addWidget(self.connectBtn, 2, 1)
         layout.addWidget(QLabel('Averages'), 4, 0)
         layout.addWidget(self.avgSpin, 5, 0)
         layout.addWidget(self.currValDisp, 5, 1)
         layout.addWidget(self.startMeasBtn, 6, 0)
         layout.addWidget(self.stopMeasBtn, 6, 1)
-        layout.setRowStretch(7, 10)
+        layout.addWidget(self.histCheck, 7, 0)
+        layout.addWidget(self.histResetBtn, 7, 1)
+        layout.setRowStretch(8, 10)
         self.addWidget(layoutWidget)
 
         ##############
-        # Network stuff
-        self.tcpClient = QtNetwork.QTcpSocket()
-        self.tcpClient.readyRead.connect(self.__getSocketData)
-        self.tcpClient.error.connect(lambda x: print(x))
+        # Network stuff, batches arrive in the thread of the client and
+        # are queued to the gui thread
+        self.ownClient = client is None
+        if self.ownClient:
+            client = MaestroClient(self.newBatch.emit, self.stateChanged.emit)
+        self.client = client
+        self.newBatch.connect(self.__getData)
+        self.stateChanged.connect(self.__stateChanged)
 
         ##############
         # make button and stuff functional
         self.connectBtn.released.connect(self.connectMeter)
-        self.avgSpin.valueChanged.connect(self.changeAverage)
         self.startMeasBtn.released.connect(self._startMeasure)
         self.stopMeasBtn.released.connect(self._stopMeasure)
-
-        ##############
-        # thread for getting data from socket
-        self.updateAvgTxt.connect(self.__updateAvgTxt)
-        self.dataAq_Thr = QThread()
-        self.dataAq_Thr.start()
-        self.dataAq_worker = GenericWorker(self.__getData)
-        self.dataAq_worker.moveToThread(self.dataAq_Thr)
+        self.histResetBtn.released.connect(self.histogram.clear)
 
 
     def connectMeter(self):
-        print('connected')
-        self.tcpClient.connectToHost(self.ipEdit.text(), int(self.portEdit.text()))
-        self.tcpClient.write('start\n'.encode())
-        self.dataAq_worker.start.emit()
+        '''
+        (Re)connect and start streaming, the client reconnects by itself
+        if the connection is lost
+        '''
+        self.client.addMeter(self.name, self.ipEdit.text(),
+                             int(self.portEdit.text()))
+        self.client.start(self.name)
 
     def _startMeasure(self):
-        self.measure = True
-        self.measureData = [] # reinitialize measure data array
-        time.sleep(0.1) # time to wait for first data to arrive
-        self.startTime = datetime.now() # datetime object
+        self.measureData.clear() # reinitialize measure data
+        self.startTime = timeBase.nanoseconds() # ns since epoch
+        self.measure = True # start time has to be set before
         
     def _stopMeasure(self):
         self.measure = False
 
     #@Slot
-    def __updateAvgTxt(self, text):
-        '''
-        update current value label
-        '''
-        self.currValDisp.setText(text)
+    def __stateChanged(self, name, state):
+        if name != self.name:
+            return
+        self.stateLabel.setText(state)
+        if state == 'connected':
+            self.connected.emit()
 
-
-    def changeAverage(self):
-        shape = int(self.avgSpin.value())
-        self.dispData = np.zeros(shape)
-    
-    def __getData(self):
+    #@Slot
+    def __getData(self, name, times, values):
         '''
-        Function run in thread
+        Handles a whole batch of samples, the next batch of this meter is
+        only sent after the ack, so batches can not pile up here
         '''
-        while self.runDataThr:
-            tmpData = np.array(int(self.avgSpin.text())*[[datetime.now(), 0]])
-            for i in range(len(tmpData)):
-                tmpData[i] = self.avgData.get()
-                if self.measure:
-                    self.measureData.append(
-                        (tmpData[i,0].isoformat().encode(),
-                         (tmpData[i,0]-self.startTime).total_seconds(),
-                         tmpData[i,1]))
-            #print('mean', tmpData.mean())
-            self.updateAvgTxt.emit(str(tmpData[:,1].mean()))
+        if name != self.name:
+            return
+        try:
             if self.measure:
-                self.newPlotData.emit(np.float_(np.asarray(self.measureData)[:,1:]))
-        self.avgData.task_done()
-
-    #@Slot()
-    def __getSocketData(self):
-        '''
-        to be called if network buffer has more data
-        push data to queue
-        '''
-        self.avgData.put([datetime.now(), float(self.tcpClient.readLine(1024).decode().rstrip())])
+                start = self.measureData.append(
+                    time=times,
+                    seconds=toSeconds(times, self.startTime),
+                    power=values)
+                # only the new tail, the whole log is in measureData
+                self.newPlotData.emit(self.measureData.tail(start))
+            if self.histCheck.isChecked():
+                self.histogram.add(values)
+            self.pending = np.concatenate((self.pending, values))
+            nAvg = self.avgSpin.value()
+            n = len(self.pending) // nAvg * nAvg
+            if n:
+                # display mean of latest complete block of nAvg samples
+                self.currValDisp.setText(str(self.pending[n-nAvg:n].mean()))
+                self.pending = self.pending[n:]
+        finally:
+            self.client.ack(name)
 
     def closeEvent(self, event):
-        if self.tcpClient.isOpen():
-            self.RunDataThr = False
-            self.tcpClient.write('stop\n'.encode())
-            time.sleep(0.1)
-            self.tcpClient.close()
-            print(self.tcpClient.isOpen())
+        self.client.removeMeter(self.name)
+        if self.ownClient:
+            self.client.close()
         #if self.console is not None:
         #    self.console.exit_interpreter()
         event.accept()
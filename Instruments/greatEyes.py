@@ -11,19 +11,22 @@ should in principle work for all other greateys cameras
 """
 
 import sys
-from ctypes import *
 import time
-import datetime
+import threading
 import numpy as np
 
 from guidata.qt.QtGui import (QSplitter, QComboBox, QGridLayout, QLineEdit,
-                              QIntValidator, QWidget, QPushButton,
-                              QSpinBox, QLabel, QMessageBox, QCheckBox,
+                              QWidget, QPushButton,
+                              QSpinBox, QDoubleSpinBox, QLabel, QMessageBox, QCheckBox,
                               QFileDialog, QPlainTextEdit)
-from guidata.qt.QtCore import (QThread, Signal, QMutex, QMutexLocker, )
+from guidata.qt.QtCore import (Signal, QMutex, QMutexLocker, )
 
 
-from Helpers.genericthread import GenericWorker
+from Helpers.housekeeping import Housekeeping
+from Helpers.scheduler import Scheduler
+from Helpers.timebase import timeBase
+from Instruments.greatEyesSdk import (loadSdk, statusMessages,
+                                      GreatEyesError)
 
 
 class GreatEyesUi(QSplitter):
@@ -32,12 +35,31 @@ class GreatEyesUi(QSplitter):
     '''
     newPlotData = Signal(object, object)
     message = Signal(object)
-    def __init__(self, parent):
+    frameSizeChanged = Signal(object, object) # pixel in x, pixel in y
+    def __init__(self, parent, addr=0, sdk=None, timeBase=timeBase):
         super().__init__(parent)
 
+        self.addr = addr # camera address, several cameras share one sdk
+        self.sdk = sdk
+        self.timeBase = timeBase # common for all cameras
+
         self.camera = None
         self.cameraSettings = None
-        self.aquireData = False
+        # parameters changed while acquiring, applied before next exposure
+        self.pendingParameters = None
+        self.acquisition = None # task of the running acquisition
+        # only one frame at a time is handed over, frames arriving while
+        # the gui still processes the last one are dropped
+        self.frameProcessed = threading.Event()
+        self.frameProcessed.set()
+        self.inFlightBuffer = None # buffer of frame handed over
+        self.displayedBuffer = None # buffer of last processed frame
+        self.droppedFrames = 0
+        self.maxFailures = 5 # camera errors in a row ending acquisition
+        self.retryDelay = 0.5 # s
+        # longest wait for a running exposure when stopping with a dll
+        # which can not abort it
+        self.stopTimeout = 10. # s
         self.directory = 'N:/4all/mpsd_drive/xtsfasta/Data'
 
         layoutWidget = QWidget()
@@ -82,21 +104,90 @@ class GreatEyesUi(QSplitter):
                   "Binning of 64 lines",
                   "Binning of 128 lines",
                   "Binning of 256 lines"])
+        self.cropSpin = QSpinBox()
+        self.cropSpin.setRange(0, 512)
+        self.cropSpin.setSingleStep(8)
+        self.cropSpin.setSuffix(' lines')
+        self.cropSpin.setSpecialValueText('no crop') # shown for 0
         self.temperatureSpin = QSpinBox()
         self.temperatureSpin.setRange(-100, 20)
         self.temperatureSpin.setValue(-10)
         self.temperatureSpin.setSuffix('°C')
-        self.updateInterSpin = QSpinBox()
-        self.updateInterSpin.setRange(1, 3600)
+        self.updateInterSpin = QDoubleSpinBox()
+        self.updateInterSpin.setRange(0, 3600)
+        self.updateInterSpin.setDecimals(2)
+        self.updateInterSpin.setSingleStep(0.1)
         self.updateInterSpin.setValue(5)
         self.updateInterSpin.setSuffix(' s')
+        self.updateInterSpin.setSpecialValueText('free run') # shown for 0
         #self.updateInterSpin.setText("2")
         #self.updateInterEdit.setValidator(QIntValidator(1, 3600))
         self.loi = QSpinBox()
         self.loi.setRange(1, 511) # one pixel less as the camera has
+        # sensor row of the line of interest, kept over binning changes
+        self.loiRow = self.loi.value()
+        self.loiBinning = 1
+        self.loiSet = self.loi.value() # last value set by a size change
         self.deltaPixels = QSpinBox()
         self.deltaPixels.setRange(0, 256)
+        self.calibEdit = QLineEdit()
+        self.calibEdit.setPlaceholderText('pixel:eV, pixel:eV, ...')
+        self.calibEdit.setToolTip('Reference lines, pixel as on the lineout '
+                                  'axis with the current binning')
+        self.calibOrderSpin = QSpinBox()
+        self.calibOrderSpin.setRange(1, 5)
+        self.calibOrderSpin.setValue(2)
+        self.calibOrderSpin.setPrefix('order ')
+        self.calibBtn = QPushButton('Fit calibration')
+        self.correctCheck = QCheckBox('Dark/flat correction')
+        self.masterNumSpin = QSpinBox()
+        self.masterNumSpin.setRange(1, 1000)
+        self.masterNumSpin.setValue(10)
+        self.masterNumSpin.setSuffix(' frames')
+        self.masterMethodCombo = QComboBox()
+        self.masterMethodCombo.addItems(['median', 'sigma clip'])
+        self.darkBtn = QPushButton('Record dark')
+        self.biasBtn = QPushButton('Record bias')
+        self.flatBtn = QPushButton('Load flat')
+        self.spikeCombo = QComboBox()
+        self.spikeCombo.addItems(['off', 'spatial', 'temporal'])
+        self.spikeSigmaSpin = QDoubleSpinBox()
+        self.spikeSigmaSpin.setRange(1, 100)
+        self.spikeSigmaSpin.setValue(5)
+        self.spikeSigmaSpin.setSuffix(' σ')
+        self.resetHotBtn = QPushButton('Reset hot pixels')
+        self.accumulateCheck = QCheckBox('Accumulate')
+        self.displayCombo = QComboBox()
+        self.displayCombo.addItems(['frame', 'mean', 'std', 'min', 'max',
+                                    'window mean'])
+        self.windowSpin = QSpinBox()
+        self.windowSpin.setRange(1, 1000)
+        self.windowSpin.setValue(10)
+        self.windowSpin.setPrefix('window ')
+        self.windowSpin.setSuffix(' frames')
+        self.saveStatsBtn = QPushButton('Save statistics')
+        self.waterfallCombo = QComboBox()
+        self.waterfallCombo.addItems(['recent', 'long term'])
+        self.exportWaterfallBtn = QPushButton('Export waterfall')
+        self.energyGridCheck = QCheckBox('Export also on uniform eV grid')
+        self.peakEdit = QLineEdit()
+        self.peakEdit.setPlaceholderText('from-to, ...')
+        self.peakEdit.setToolTip('Peak windows in pixels of the lineout')
+        self.peakBtn = QPushButton('Track peaks')
+        self.peakCombo = QComboBox()
+        self.peakCombo.addItems(['intensity', 'centroid', 'peak', 'fwhm'])
+        self.exportPeaksBtn = QPushButton('Export peaks')
         self.autoSave = QCheckBox("Auto save")
+        self.compressionCombo = QComboBox()
+        self.compressionCombo.addItems(['gzip', 'lz4', 'blosc'])
+        self.compressionLevel = QSpinBox()
+        self.compressionLevel.setRange(0, 9)
+        self.compressionLevel.setValue(4)
+        self.pngInterSpin = QSpinBox()
+        self.pngInterSpin.setRange(0, 3600)
+        self.pngInterSpin.setValue(0)
+        self.pngInterSpin.setSuffix(' s')
+        self.pngInterSpin.setSpecialValueText('no PNG') # shown for 0
         self.getDirectory = QPushButton('Choose Dir')
         self.dirPath = QLineEdit(self.directory)
         self.comment = QPlainTextEdit()
@@ -113,20 +204,54 @@ class GreatEyesUi(QSplitter):
         layout.addWidget(self.binningXCombo, 3, 1)
         layout.addWidget(QLabel('binning Y'), 4, 0)
         layout.addWidget(self.binningYCombo, 4, 1)
-        layout.addWidget(QLabel('temperature'), 5, 0)
-        layout.addWidget(self.temperatureSpin, 5, 1)
-        layout.addWidget(QLabel('update every n-seconds'), 6, 0)
-        layout.addWidget(self.updateInterSpin, 6, 1)
-        layout.addWidget(QLabel('Pixel of interest'), 7, 0)
-        layout.addWidget(self.loi, 7, 1)
-        layout.addWidget(QLabel('Δ pixels'), 8, 0)
-        layout.addWidget(self.deltaPixels, 8, 1)
-        layout.addWidget(self.autoSave, 9, 1)
-        layout.addWidget(self.getDirectory, 10, 0)
-        layout.addWidget(self.dirPath, 10, 1)
-        layout.addWidget(QLabel('Comment:'), 11, 0)
-        layout.addWidget(self.comment, 12, 0, 1, 2)
-        layout.setRowStretch(13, 10)
+        layout.addWidget(QLabel('crop readout'), 5, 0)
+        layout.addWidget(self.cropSpin, 5, 1)
+        layout.addWidget(QLabel('temperature'), 6, 0)
+        layout.addWidget(self.temperatureSpin, 6, 1)
+        layout.addWidget(QLabel('update every n-seconds'), 7, 0)
+        layout.addWidget(self.updateInterSpin, 7, 1)
+        layout.addWidget(QLabel('Pixel of interest'), 8, 0)
+        layout.addWidget(self.loi, 8, 1)
+        layout.addWidget(QLabel('Δ pixels'), 9, 0)
+        layout.addWidget(self.deltaPixels, 9, 1)
+        layout.addWidget(QLabel('calibration'), 10, 0)
+        layout.addWidget(self.calibEdit, 10, 1)
+        layout.addWidget(self.calibOrderSpin, 11, 0)
+        layout.addWidget(self.calibBtn, 11, 1)
+        layout.addWidget(self.correctCheck, 12, 0)
+        layout.addWidget(self.flatBtn, 12, 1)
+        layout.addWidget(self.masterNumSpin, 13, 0)
+        layout.addWidget(self.masterMethodCombo, 13, 1)
+        layout.addWidget(self.darkBtn, 14, 0)
+        layout.addWidget(self.biasBtn, 14, 1)
+        layout.addWidget(QLabel('spike filter'), 15, 0)
+        layout.addWidget(self.spikeCombo, 15, 1)
+        layout.addWidget(self.spikeSigmaSpin, 16, 0)
+        layout.addWidget(self.resetHotBtn, 16, 1)
+        layout.addWidget(self.accumulateCheck, 17, 0)
+        layout.addWidget(self.displayCombo, 17, 1)
+        layout.addWidget(self.windowSpin, 18, 0)
+        layout.addWidget(self.saveStatsBtn, 18, 1)
+        layout.addWidget(self.waterfallCombo, 19, 0)
+        layout.addWidget(self.exportWaterfallBtn, 19, 1)
+        layout.addWidget(self.energyGridCheck, 20, 0, 1, 2)
+        layout.addWidget(QLabel('peak windows'), 21, 0)
+        layout.addWidget(self.peakEdit, 21, 1)
+        layout.addWidget(self.peakBtn, 22, 0)
+        layout.addWidget(self.peakCombo, 22, 1)
+        layout.addWidget(self.exportPeaksBtn, 23, 0)
+        layout.addWidget(self.autoSave, 23, 1)
+        layout.addWidget(QLabel('compression'), 24, 0)
+        layout.addWidget(self.compressionCombo, 24, 1)
+        layout.addWidget(QLabel('compression level'), 25, 0)
+        layout.addWidget(self.compressionLevel, 25, 1)
+        layout.addWidget(QLabel('PNG snapshot every'), 26, 0)
+        layout.addWidget(self.pngInterSpin, 26, 1)
+        layout.addWidget(self.getDirectory, 27, 0)
+        layout.addWidget(self.dirPath, 27, 1)
+        layout.addWidget(QLabel('Comment:'), 28, 0)
+        layout.addWidget(self.comment, 29, 0, 1, 2)
+        layout.setRowStretch(30, 10)
 
         self.addWidget(layoutWidget)
 
@@ -138,29 +263,33 @@ class GreatEyesUi(QSplitter):
         self.temperatureSpin.valueChanged.connect(self.__setTemperature)
         self.exposureTimeSpin.valueChanged.connect(self.__setCamParameter)
         self.readoutSpeedCombo.currentIndexChanged.connect(self.__setCamParameter)
+        self.binningXCombo.currentIndexChanged.connect(self.__setCamParameter)
+        self.binningYCombo.currentIndexChanged.connect(self.__setCamParameter)
+        self.cropSpin.editingFinished.connect(self.__setCropMode)
+        self.frameSizeChanged.connect(self.__frameSizeChanged)
         self.startAquBtn.released.connect(self.__startCurrImageThr)
         
         ################
-        # thread for updating position
-        self.currImage_thread = QThread() # create the QThread
-        self.currImage_thread.start()
+        # task for continuous acquisition
+        self.scheduler = Scheduler()
 
-        # This causes my_worker.run() to eventually execute in my_thread:
-        self.currImage_worker = GenericWorker(self.__getCurrImage)
-        self.currImage_worker.moveToThread(self.currImage_thread)
+        ################
+        # temperatures are polled in their own thread while camera is idle
+        self.housekeeping = Housekeeping()
  
         self.startAquBtn.setEnabled(False) 
         self.readoutSpeedCombo.setEnabled(False)
         self.exposureTimeSpin.setEnabled(False)
         self.binningXCombo.setEnabled(False)
         self.binningYCombo.setEnabled(False)
+        self.cropSpin.setEnabled(False)
         self.temperatureSpin.setEnabled(False)
         self.updateInterSpin.setEnabled(False)
       
 
 
     def __openCam(self):
-        self.camera = greatEyes()
+        self.camera = greatEyes(sdk=self.sdk, addr=self.addr)
         if not self.camera.connected:
             msg = QMessageBox()
             msg.setIcon(QMessageBox.Critical)
@@ -174,13 +303,23 @@ class GreatEyesUi(QSplitter):
 
         self.readoutSpeedCombo.setEnabled(True)
         self.exposureTimeSpin.setEnabled(True)
-        self.binningXCombo.setEnabled(False)
-        self.binningYCombo.setEnabled(False)
+        self.binningXCombo.setEnabled(True)
+        self.binningYCombo.setEnabled(True)
+        self.cropSpin.setEnabled(True)
+        self.cropSpin.setMaximum(self.camera.sensorSizeY)
         self.temperatureSpin.setEnabled(True)
         self.updateInterSpin.setEnabled(True)
 
         self.openCamBtn.setEnabled(False)
         self.startAquBtn.setEnabled(True) 
+        self.housekeeping.addReader('temperature',
+            lambda: self.camera.getTemperature(0, onlyIdle=True))
+        self.housekeeping.addReader('backside_temperature',
+            lambda: self.camera.getTemperature(1, onlyIdle=True))
+        self.housekeeping.poll()
+        self.housekeeping.start(lambda: not self.camera.measurementRunning)
+        self.frameSizeChanged.emit(self.camera.numPixelInX,
+                                   self.camera.numPixelInY)
 
     def __chooseDir(self):
         self.directory = QFileDialog.getExistingDirectory(self,
@@ -189,10 +328,20 @@ class GreatEyesUi(QSplitter):
         self.dirPath.setText(self.directory)
 
 
+    def closeEvent(self, event):
+        self.__stopCurrImageThr()
+        # waits until the camera is left idle, the dll must not be unloaded
+        # while the acquisition still uses it
+        self.scheduler.close(timeout=None)
+        self.housekeeping.close()
+
     def __startCurrImageThr(self):
-        if not self.aquireData:
-            self.aquireData = True
-            self.currImage_worker.start.emit()
+        if self.acquisition is None:
+            self.housekeeping.reset()
+            # starts as soon as a stopped acquisition left the camera idle
+            self.acquisition = self.scheduler.submit(self.__getCurrImage,
+                lane='camera', onDone=self.__acquisitionFinished)
+            self.__enableFrameControls(False)
             self.startAquBtn.setText('Stop aquisition')
             self.message.emit('Starting aqusition')
         else:
@@ -200,63 +349,264 @@ class GreatEyesUi(QSplitter):
             self.startAquBtn.setText('Start aquisition')
             self.message.emit('Stopping aqusition')
     def __stopCurrImageThr(self):
-        self.aquireData = False
-        #while(self.currPosThr.isRunning()):
-        #    time.sleep(0.03)
-    def __getCurrImage(self):
-        #from scipy import mgrid
-        #import numpy as np
-        #X, Y = mgrid[-256:256, -1024:1025]
-        i = self.updateInterSpin.value()
-        while self.aquireData:
-            # seconds over which to record a new image
-            imageIntervall = self.updateInterSpin.value()
-            # sleep for n seconds to check if intervall was changed
-            sleepy = 1
-            if i >= imageIntervall:
-                # dummy image
-                #z = np.exp(-0.5*(X**2+Y**2)/np.random.uniform(30000, 40000))*np.cos(0.1*X+0.1*Y)
-                z = self.camera.getImage()
-                timeStamp = datetime.datetime.now()
-                self.cameraSettings = {
-                        'temperature': self.camera.getTemperature(),
-                        'exposure_time': self.exposureTimeSpin.value(),
-                        'readout_speed': self.readoutSpeedCombo.currentText()
-                        'time_stamp': timeStamp}
-                self.newPlotData.emit(z, timeStamp)
-                i = 0 # restart counter
-            i += sleepy
-            time.sleep(sleepy)
+        if self.acquisition is not None:
+            self.acquisition.cancel()
+            self.acquisition = None
+    def __acquisitionFinished(self, task):
+        if task.state == 'failed':
+            self.message.emit('Aquisition failed: ' + str(task.error))
+        if task is self.acquisition:
+            # ended without being stopped
+            self.acquisition = None
+            self.startAquBtn.setText('Start aquisition')
+        if self.acquisition is None:
+            # camera is idle, frame size may change again
+            self.__enableFrameControls(True)
+            if self.pendingParameters is not None:
+                self.__setCamParameter(None)
+    def __enableFrameControls(self, enable):
+        '''
+        Readout, binning and crop resize the buffer pool, they can not be
+        changed while a frame is exposed or read out
+        '''
+        self.readoutSpeedCombo.setEnabled(enable)
+        self.binningXCombo.setEnabled(enable)
+        self.binningYCombo.setEnabled(enable)
+        self.cropSpin.setEnabled(enable)
+    def __getCurrImage(self, token):
+        '''
+        Continuous acquisition, run in thread.
+        Uses the non blocking measurement of the dll: as soon as a frame is
+        read out, the next exposure is started (if due) before the frame is
+        handed over. Start of exposures is scheduled on a monotonic clock,
+        an interval of 0 means free run as fast as possible.
+        Temperatures come from the housekeeping cache, in free run the
+        camera is never idle and they are read between two exposures when
+        due.
+        '''
+        self.droppedFrames = 0
+        try:
+            self.__acquire(token)
+        finally:
+            # leave camera idle, abort a still running exposure or, if the
+            # dll can not, wait a bounded time for it and drop it
+            if self.camera.measurementRunning and \
+                    not self.camera.stopMeasurement():
+                deadline = time.monotonic() + self.stopTimeout
+                self.camera.waitMeasurement(
+                    lambda: time.monotonic() < deadline)
+                if not self.camera.isBusy():
+                    try:
+                        self.camera.getMeasurementData()
+                    except GreatEyesError:
+                        pass
+
+    def __acquire(self, token):
+        if not self.__startExposure(token):
+            return
+        lastStart = time.monotonic()
+        readFailures = 0
+        while not token.cancelled():
+            if not self.camera.waitMeasurement(
+                    lambda: not token.cancelled()):
+                break
+            try:
+                z = self.camera.getMeasurementData()
+            except GreatEyesError as e:
+                readFailures += 1
+                self.message.emit(str(e))
+                if readFailures >= self.maxFailures:
+                    raise
+                if token.wait(self.retryDelay) or \
+                        not self.__startExposure(token):
+                    break
+                lastStart = time.monotonic()
+                continue
+            readFailures = 0
+            buffer = self.camera.lastBuffer
+            timeStamp = self.timeBase.nanoseconds()
+
+            # start next exposure before handing over the frame if it is due
+            # already, interval is seconds between start of two exposures
+            started = False
+            if lastStart + self.updateInterSpin.value() <= time.monotonic():
+                self.housekeeping.pollIfDue()
+                if not self.__startExposure(token):
+                    break
+                lastStart = time.monotonic()
+                started = True
+
+            self.__handOver(z, buffer, timeStamp)
+
+            if not started:
+                # wait in small steps to react on changed interval, returns
+                # at once if stopped
+                while not token.cancelled():
+                    remaining = (lastStart + self.updateInterSpin.value() -
+                                 time.monotonic())
+                    if remaining <= 0:
+                        break
+                    token.wait(min(remaining, 0.05))
+                if token.cancelled() or not self.__startExposure(token):
+                    break
+                lastStart = time.monotonic()
+
+    def __startExposure(self, token):
+        '''
+        Start next exposure, retry after a delay if the camera refuses.
+        Returns False if stopped meanwhile, raises after maxFailures
+        failures in a row, which ends the acquisition.
+        '''
+        parameters, self.pendingParameters = self.pendingParameters, None
+        if parameters is not None:
+            self.__applyCamParameter(parameters)
+        for i in range(self.maxFailures):
+            if self.camera.startMeasurement():
+                return True
+            self.message.emit('Could not start exposure, retrying')
+            if token.wait(self.retryDelay):
+                return False
+        raise GreatEyesError('StartMeasurement', -1)
+
+    def __handOver(self, z, buffer, timeStamp):
+        '''
+        Emit frame if the gui finished the last one, else drop it. The
+        buffer is held until the gui is done with the frame.
+        '''
+        if not self.frameProcessed.is_set():
+            self.droppedFrames += 1
+            if self.droppedFrames % 100 == 1:
+                self.message.emit('{:d} frames dropped, display too slow'
+                                  .format(self.droppedFrames))
+            return
+        self.frameProcessed.clear()
+        self.camera.holdBuffer(buffer)
+        self.inFlightBuffer = buffer
+        # settings in effect when the exposure of this frame was started
+        settings = dict(self.camera.lastSettings)
+        settings['readout_speed'] = self.readoutSpeedCombo.itemText(
+            settings['readout_speed'])
+        settings.update({
+                'temperature': self.housekeeping.get('temperature'),
+                'backside_temperature':
+                    self.housekeeping.get('backside_temperature'),
+                'set_temperature': self.temperatureSpin.value(),
+                'time_stamp': timeStamp})
+        self.cameraSettings = settings
+        self.newPlotData.emit(z, timeStamp)
+
+    def frameSettings(self):
+        '''
+        Binning and crop mode of the camera, they define the frame layout
+        '''
+        return {'binning_x': self.camera.binningX,
+                'binning_y': self.camera.binningY,
+                'crop_lines': self.camera.cropLines}
+
+    def frameDone(self):
+        '''
+        To be called by the consumer of newPlotData when it finished a
+        frame. The buffer of the frame stays held while it is displayed,
+        until the next frame is done.
+        '''
+        if self.displayedBuffer is not None:
+            self.camera.releaseBuffer(self.displayedBuffer)
+        self.displayedBuffer = self.inFlightBuffer
+        self.inFlightBuffer = None
+        self.frameProcessed.set()
 
     def __setTemperature(self, temp):
         self.camera.setTemperture(temp)
         self.message.emit('Temperature set to {:d}°C'.format(temp))
 
     def __setCamParameter(self, param):
-        self.camera.setCameraParameter(
-                self.readoutSpeedCombo.currentIndex(), 
-                self.exposureTimeSpin.value(), 
-                0, 0)
-        self.message.emit('Readout: {:s}, Exposure: {:d}, binningX: 0, binningY: 0'.format(self.readoutSpeedCombo.currentText(),
-               self.exposureTimeSpin.value()))
+        parameters = (self.readoutSpeedCombo.currentIndex(),
+                      self.exposureTimeSpin.value(),
+                      self.binningXCombo.currentIndex(),
+                      self.binningYCombo.currentIndex())
+        if self.acquisition is not None:
+            # the dll is exposing, only the exposure time can change and it
+            # is set by the acquisition before the next exposure
+            self.pendingParameters = parameters
+            return
+        self.pendingParameters = None
+        self.__applyCamParameter(parameters)
+        self.frameSizeChanged.emit(self.camera.numPixelInX,
+                                   self.camera.numPixelInY)
+
+    def __applyCamParameter(self, parameters):
+        readoutSpeed, exposureTime, binningX, binningY = parameters
+        self.camera.setCameraParameter(*parameters)
+        self.message.emit('Readout: {:s}, Exposure: {:d}, binningX: {:d}, binningY: {:d}'.format(
+               self.readoutSpeedCombo.itemText(readoutSpeed),
+               exposureTime, binningX, binningY))
+
+    def __setCropMode(self):
+        if self.camera is None:
+            return
+        if self.camera.setCropMode(self.cropSpin.value()):
+            self.frameSizeChanged.emit(self.camera.numPixelInX,
+                                       self.camera.numPixelInY)
+            self.message.emit('Crop mode: {:s}'.format(self.cropSpin.text()))
+        else:
+            self.message.emit('Could not set crop mode')
+
+    def __frameSizeChanged(self, nx, ny):
+        '''
+        Keep line of interest on the same sensor row. Binning scales the
+        line, crop mode keeps lines 1:1 and only limits the range.
+        '''
+        if self.loi.value() != self.loiSet:
+            # moved by the user since the last change
+            self.loiRow = self.loi.value() * self.loiBinning
+        self.loiBinning = 2**self.binningYCombo.currentIndex()
+        self.loi.setRange(0, max(0, ny-1))
+        self.loi.setValue(min(self.loiRow // self.loiBinning, max(0, ny-1)))
+        self.loiSet = self.loi.value()
+        self.deltaPixels.setRange(0, max(0, ny//2))
 
 
 class greatEyes:
-    def __init__(self, readoutSpeed=0, exposureTime=1e3, binningX=0, binningY=0):
-        # Mutex
+    def __init__(self, readoutSpeed=0, exposureTime=1e3, binningX=0, binningY=0,
+                 numBuffers=3, sdk=None, addr=0):
+        # Mutex, one per camera, cameras are independent
         self.mutex =  QMutex()
 
-        # load dll
-        self.greateyesLib = WinDLL('greateyes.dll')
+        # typed bindings of the dll, or the simulator, shared by all cameras
+        self.sdk = loadSdk() if sdk is None else sdk
+        self.addr = addr # address of camera in multi camera system
         self.tempCalibNumber = 42223# you get this number via software, camera info
         
         # get set by setCameraParameters()
         self.numPixelInX = 0
         self.numPixelInY = 0
         self.pixelSize = 0
+        self.sensorSizeX = 0 # unbinned, uncropped sensor size
+        self.sensorSizeY = 0
+        self.readoutSpeed = 0 # index of readout speed
+        self.exposureTime = 0 # ms
+        self.binningX = 0 # index of binning mode, factor 2**binning
+        self.binningY = 0
+        self.cropLines = 0 # 0: crop mode off
+        self.cropColumns = 0
         self.connected = False
         self.status = ""
 
+        # pool of preallocated image buffers the dll writes into directly,
+        # returned images are views on these. A consumer holds a buffer
+        # with holdBuffer() as long as it uses the image, held buffers are
+        # not written. At least three: one read out, one handed over, one
+        # still displayed
+        self.numBuffers = max(3, int(numBuffers))
+        self.bufferPool = []
+        self.bufferIdx = 0
+        self.heldBuffers = []
+        self.lastBuffer = None # buffer of last read out image
+        self.measurementRunning = False
+        # settings of the running measurement and of the last read out image
+        self.runningSettings = None
+        self.lastSettings = None
+
         if not self.connectCamera():
             return None
         if not self.setCameraParameter(readoutSpeed, exposureTime, 
@@ -274,164 +624,258 @@ class greatEyes:
         return np.random.random((10,10))
 
     def checkSDKVersion(self):
-        ###
-        # check SDK version
-        # only get first number, probably needs iterating through char array...
-        func = self.greateyesLib.GetDLLVersion
-        func.restype = POINTER(c_char)
-        func.argtypes = [POINTER(c_int)]
-        l = c_int()
-        data = func(byref(l))
-        print(data,l,data.contents)
+        print(self.sdk.dllVersion())
 
     def connectCamera(self):
         ###
         # connect camera
-        getCamera = self.greateyesLib.CheckCamera
-        getCamera.retype = c_bool
-        getCamera.argtypes = [POINTER(c_int), POINTER(POINTER(c_char)), POINTER(c_int)]
-        modelId   = c_int()
-        model     = POINTER(c_char)()
-        statusMsg = c_int()
-        status = {6: 'New camera detected',
-                  0: 'Camera OK and connected',
-                  1: 'No camera connected',
-                  2: 'Could not open USBDevice',
-                  3: 'WriteConfigTable failes',
-                  4: 'WriteReadRequest failed',
-                  7: 'Unknown ModelID'}
-        if getCamera(byref(modelId), byref(model), byref(statusMsg)):
-            #print(modelId, model.contents, statusMsg)
-            print(status[int(statusMsg.value)])
-            self.status = status[int(statusMsg.value)]
+        try:
+            if self.sdk.multiCamera:
+                status = self.sdk.connectCamera(addr=self.addr)
+            else:
+                status = self.sdk.checkCamera()
+            self.status = statusMessages.get(status, str(status))
+            print(self.status)
             return True
-        else:
-            print(status[int(statusMsg.value)])
-            self.status = status[int(statusMsg.value)]
+        except GreatEyesError as e:
+            print(e)
+            self.status = statusMessages.get(e.status, str(e))
             return False
 
     def setCameraParameter(self, readoutSpeed, exposureTime, 
                            binningX, binningY):
         ###
         # set camera parameters
-        camSettings = self.greateyesLib.CamSettings
-        camSettings.retype = c_bool
-        camSettings.argtypes = [c_int, c_int, c_int, c_int, 
-                                POINTER(c_int), POINTER(c_int),
-                                POINTER(c_int), POINTER(c_int),
-                                c_int]
-        readSpeed = c_int(int(readoutSpeed))
-        exposure  = c_int(int(exposureTime))
-        binningX     = c_int(int(0))
-        binningY     = c_int(int(0))
-        numPixelInX  = c_int()
-        numPixelInY  = c_int()
-        pixelSize    = c_int()
-        statusMsg    = c_int()
-        addr         = c_int(0)
-        status = {0: 'Camera OK and connected',
-                  3: 'WriteConfigTable failes',
-                  7: 'Unknown ModelID',
-                  8: 'Out of range'}
         with QMutexLocker(self.mutex):
             print(readoutSpeed, exposureTime, binningX, binningY)
-            if camSettings(readSpeed, exposure, binningX, binningY, 
-                                 byref(numPixelInX), byref(numPixelInY),
-                                 byref(pixelSize), byref(statusMsg), addr):
-                print('Set camera parameters status:', status[int(statusMsg.value)])
-                self.numPixelInX = int(numPixelInX.value)
-                self.numPixelInY = int(numPixelInY.value)
-                self.pixelSize = int(pixelSize.value)
-                return True
-            else:
-                print('Set camera parameters status:', status[int(statusMsg.value)])
+            try:
+                numPixelInX, numPixelInY, pixelSize = self.sdk.camSettings(
+                        readoutSpeed, exposureTime, binningX, binningY,
+                        addr=self.addr)
+            except GreatEyesError as e:
+                print('Set camera parameters status:', e)
                 return False
+            if self.sensorSizeX == 0:
+                # first call, without binning and crop mode
+                self.sensorSizeX = numPixelInX
+                self.sensorSizeY = numPixelInY
+            self.pixelSize = pixelSize
+            self.readoutSpeed = int(readoutSpeed)
+            self.exposureTime = int(exposureTime)
+            self.binningX = int(binningX)
+            self.binningY = int(binningY)
+            self.updateImageSize()
+            return True
         
         
+    def setCropMode(self, lines=0, columns=0):
+        '''
+        Only read out the given number of lines (and columns) next to the
+        readout register, lines=0 switches crop mode off
+        '''
+        lines = min(int(lines), self.sensorSizeY)
+        columns = min(int(columns), self.sensorSizeX)
+        with QMutexLocker(self.mutex):
+            try:
+                if lines > 0:
+                    self.sdk.setupCropMode2D(columns or self.sensorSizeX,
+                                             lines, addr=self.addr)
+                self.sdk.activateCropMode(lines > 0, addr=self.addr)
+            except GreatEyesError as e:
+                print(e)
+                return False
+            self.cropLines = lines
+            self.cropColumns = columns
+            self.updateImageSize()
+            return True
+
+    def updateImageSize(self):
+        '''
+        Size of the frames with current binning and crop mode, has to be
+        called with locked mutex
+        '''
+        if self.sdk.hasFunction('GetImageSize'):
+            self.numPixelInX, self.numPixelInY, bytesPerPixel = \
+                self.sdk.getImageSize(addr=self.addr)
+        else:
+            # older dll, compute it from binning and crop settings
+            cols  = self.cropColumns or self.sensorSizeX
+            lines = self.cropLines or self.sensorSizeY
+            if self.binningX >= 8: # full horizontal binning
+                self.numPixelInX = 1
+            else:
+                self.numPixelInX = max(1, cols // 2**self.binningX)
+            self.numPixelInY = max(1, lines // 2**self.binningY)
+        self.allocBuffers()
+
+    def allocBuffers(self):
+        '''
+        (Re)allocate the image buffer pool for the current frame size,
+        only if the frame size changed
+        '''
+        numPixel = self.numPixelInX * self.numPixelInY
+        if self.bufferPool and self.bufferPool[0].size == numPixel:
+            return
+        self.bufferPool = [np.empty(numPixel, dtype=np.uint16)
+                           for i in range(self.numBuffers)]
+        self.bufferIdx = 0
+        # views on the old buffers keep them alive, they are not reused
+        self.heldBuffers = []
+
+    def nextBuffer(self):
+        '''
+        Return next buffer of the pool (round robin) which is not held
+        '''
+        for i in range(self.numBuffers):
+            idx = (self.bufferIdx + i) % self.numBuffers
+            if not any(self.bufferPool[idx] is b for b in self.heldBuffers):
+                break
+        else:
+            raise RuntimeError('All image buffers are held')
+        self.bufferIdx = (idx + 1) % self.numBuffers
+        self.lastBuffer = self.bufferPool[idx]
+        return self.lastBuffer
+
+    def holdBuffer(self, buf):
+        '''
+        Buffer is not written until it is released
+        '''
+        with QMutexLocker(self.mutex):
+            self.heldBuffers.append(buf)
+
+    def releaseBuffer(self, buf):
+        with QMutexLocker(self.mutex):
+            self.heldBuffers = [b for b in self.heldBuffers if b is not buf]
+
     def initTempControl(self):
         ###
         # initialize temperature control
-        tempertureControlSetup = self.greateyesLib.TemperatureControl_Setup
-        tempertureControlSetup.retypes  = c_int
-        tempertureControlSetup.argtypes = [c_int, POINTER(c_int), c_int]
-        coolingOption = c_int(self.tempCalibNumber) 
-        statusMsg     = c_int()
-        tempLevels = tempertureControlSetup(coolingOption, byref(statusMsg), c_int(0))
+        tempLevels = self.sdk.temperatureControlSetup(self.tempCalibNumber,
+                                                      addr=self.addr)
         print('Number of cooling levels:', tempLevels)
 
     def setTemperture(self, setTemp=-9):
         ###
         # set cooling level
-        setTemperatureControl = self.greateyesLib.TemperatureControl_SetTemperatureLevel
-        setTemperatureControl.retypes = c_bool
-        setTemperatureControl.argtypes = [c_int, POINTER(c_int), c_int]
-        statusMsg = c_int()
         #[20, 15, 10, 5, 0, -5, -10, -15, -20, -25, -30,... -100]
         tempList = np.arange(20, -101, -5) # available tempertures I extracted from greatVision sw
         tempIndex = tempList.shape[0]-tempList[::-1].searchsorted(setTemp)
         print(u'Setting temperature to {:d}°C'.format(tempList[tempIndex]))
         with QMutexLocker(self.mutex):
-            if setTemperatureControl(c_int(tempIndex), byref(statusMsg), c_int(0)):
+            try:
+                self.sdk.setTemperatureLevel(tempIndex, addr=self.addr)
                 print('Camera temperature controller is set')
-            else:
-                print('An error occured in setting the temperature')
+            except GreatEyesError as e:
+                print('An error occured in setting the temperature:', e)
 
-    def getTemperature(self):
+    def getTemperature(self, sensor=0, onlyIdle=False):
         ###
-        # Get Temperature from Chip
-        getTemperature = self.greateyesLib.TemperatureControl_GetTemperature
-        getTemperature.retype = c_bool
-        getTemperature.argtypes = [c_int, POINTER(c_int), POINTER(c_int), c_int]
-        temperature = c_int()
-        statusMsg   = c_int()
-        with QMutexLocker(self.mutex):
-            if getTemperature(c_int(0), byref(temperature), byref(statusMsg), c_int(0)):
-                return temperature.value
-        #getTemperatureBool = getTemperature(c_int(1), byref(temperature), byref(statusMsg), c_int(0))
-        #print("backside temperature:", temperature.value)
+        # Get Temperature from Chip (sensor 0) or backside (sensor 1)
+        # onlyIdle: returns None at once instead of waiting if the camera
+        # is in use or a measurement is running, for housekeeping reads
+        # which must never delay the acquisition
+        if onlyIdle:
+            if not self.mutex.tryLock():
+                return None
+        else:
+            self.mutex.lock()
+        try:
+            if onlyIdle and self.measurementRunning:
+                return None
+            return self.sdk.getTemperature(sensor, addr=self.addr)
+        except GreatEyesError:
+            return None
+        finally:
+            self.mutex.unlock()
+
+    def settings(self):
+        '''
+        Current camera settings, readout speed is the index
+        '''
+        return {'readout_speed': self.readoutSpeed,
+                'exposure_time': self.exposureTime,
+                'binning_x': self.binningX,
+                'binning_y': self.binningY,
+                'crop_lines': self.cropLines}
 
     def getImage(self):
         ###
         # Get image
-        getImage = self.greateyesLib.PerformMeasurement_Blocking
-        getImage.retype   = c_bool
-        getImage.argtypes = [c_bool, c_bool, c_bool, c_bool, c_int, 
-                             POINTER(c_ushort), POINTER(c_int), POINTER(c_int),
-                             POINTER(c_int), c_int]
-        correctBias = c_bool()
-        showSync    = c_bool()
-        showShutter = c_bool()
-        triggerMode = c_bool()
-        triggerTimeout = c_int()
-        # http://stackoverflow.com/questions/13553353/python-handling-c-malloc-variables-with-ctypes
-        dll = CDLL('msvcrt')
-        n = dll.malloc(self.numPixelInX * self.numPixelInY * sizeof(c_short))
-        pIndataStart   = cast(n, POINTER(c_ushort))
-        writeBytes  = c_int()
-        readBytes   = c_int()
-        statusMsg   = c_int()
-        addr        = c_int(0)
         with QMutexLocker(self.mutex):
-            getImageBool = getImage(correctBias, showSync, showShutter, triggerMode, triggerTimeout,
-                                pIndataStart, byref(writeBytes), byref(readBytes),
-                                byref(statusMsg), addr)
-            imageData = np.array(np.ones(self.numPixelInX * self.numPixelInY), dtype=np.short)
-            for i in range(self.numPixelInX * self.numPixelInY):
-                imageData[i] = pIndataStart[i]
+            # dll writes directly into the numpy buffer, no copy needed
+            imageData = self.nextBuffer()
+            self.sdk.performMeasurementBlocking(imageData, addr=self.addr)
+            self.lastSettings = self.settings()
+            # view on buffer, flipped in x like in greatVision
             return imageData.reshape(self.numPixelInY, self.numPixelInX)[:,::-1]
-        #from guiqwt import pyplot
-        #pyplot.imshow(imageData)
-        #pyplot.show()
 
 
+    def startMeasurement(self):
+        '''
+        Start exposure without waiting for it, get the image with
+        waitMeasurement() and getMeasurementData()
+        '''
+        with QMutexLocker(self.mutex):
+            try:
+                self.sdk.startMeasurement(addr=self.addr)
+                self.measurementRunning = True
+                self.runningSettings = self.settings()
+            except GreatEyesError as e:
+                print(e)
+                self.measurementRunning = False
+            return self.measurementRunning
+
+    def stopMeasurement(self):
+        '''
+        Abort a started measurement, returns False if the dll does not
+        support it or failed
+        '''
+        if not self.sdk.hasFunction('StopMeasurement'):
+            return False
+        with QMutexLocker(self.mutex):
+            try:
+                self.sdk.stopMeasurement(addr=self.addr)
+            except GreatEyesError as e:
+                print(e)
+                return False
+            self.measurementRunning = False
+            return True
+
+    def isBusy(self):
+        '''
+        True as long as the camera is exposing or reading out
+        '''
+        with QMutexLocker(self.mutex):
+            return self.sdk.isBusy(addr=self.addr)
+
+    def waitMeasurement(self, keepWaiting=lambda: True, pollTime=0.005):
+        '''
+        Wait for a started measurement to finish. Returns False if
+        keepWaiting() returned False before the measurement was finished
+        '''
+        while self.isBusy():
+            if not keepWaiting():
+                return False
+            time.sleep(pollTime)
+        return True
+
+    def getMeasurementData(self):
+        '''
+        Read out image of finished measurement into the next buffer of the
+        pool and return a view on it
+        '''
+        with QMutexLocker(self.mutex):
+            imageData = self.nextBuffer()
+            self.measurementRunning = False
+            self.lastSettings = self.runningSettings
+            self.sdk.getMeasurementData(imageData, addr=self.addr)
+            return imageData.reshape(self.numPixelInY, self.numPixelInX)[:,::-1]
+
     def closeCamera(self):
         ###
         # close camera
         with QMutexLocker(self.mutex):
-            closeCamera = self.greateyesLib.CloseCamera
-            closeCamera.retype = c_bool
-            closeCamera.argtype = [c_int, c_bool]
-            closeCameraBool = closeCamera(c_int(0), c_bool(False))
+            self.sdk.closeCamera(addr=self.addr)
 
         
 def main():
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+Bindings for the greateyes camera SDK
+
+All entry points are looked up and typed once when the library is loaded,
+the methods of the backends are thin wrappers which raise GreatEyesError
+if the SDK reports a failure. SimulatedSdk has the same interface and
+needs no camera, use it with GREATEYES_BACKEND=simulator.
+"""
+
+import os
+import sys
+import time
+from ctypes import (CDLL, POINTER, byref, c_bool, c_char, c_int, c_ushort)
+import numpy as np
+
+
+statusMessages = {0: 'Camera OK and connected',
+                  1: 'No camera connected',
+                  2: 'Could not open USBDevice',
+                  3: 'WriteConfigTable failes',
+                  4: 'WriteReadRequest failed',
+                  5: 'No trigger signal',
+                  6: 'New camera detected',
+                  7: 'Unknown ModelID',
+                  8: 'Out of range',
+                  9: 'No new data',
+                  10: 'Camera busy',
+                  11: 'Cooling turned off',
+                  12: 'Measurement stopped',
+                  -2: 'Not supported by this DLL'}
+notSupported = -2 # status of entry points missing in older dll versions
+
+
+class GreatEyesError(Exception):
+    '''
+    SDK function returned false, status holds the status message code
+    '''
+    def __init__(self, function, status):
+        self.function = function
+        self.status = status
+        super(GreatEyesError, self).__init__('{:s}: {:s}'.format(function,
+                statusMessages.get(status, 'status {:d}'.format(status))))
+
+
+# name: (restype, argtypes)
+prototypes = {
+    'GetDLLVersion': (POINTER(c_char), [POINTER(c_int)]),
+    'CheckCamera': (c_bool, [POINTER(c_int), POINTER(POINTER(c_char)),
+                             POINTER(c_int)]),
+    'ConnectToMultiCameraSystem': (c_bool, [POINTER(c_int)]),
+    'ConnectCamera': (c_bool, [POINTER(c_int), POINTER(POINTER(c_char)),
+                               POINTER(c_int), c_int]),
+    'CamSettings': (c_bool, [c_int, c_int, c_int, c_int, POINTER(c_int),
+                             POINTER(c_int), POINTER(c_int), POINTER(c_int),
+                             c_int]),
+    'SetupCropMode2D': (c_bool, [c_int, c_int, c_int]),
+    'ActivateCropMode': (c_bool, [c_bool, c_int]),
+    'GetImageSize': (c_bool, [POINTER(c_int), POINTER(c_int), POINTER(c_int),
+                              c_int]),
+    'TemperatureControl_Setup': (c_int, [c_int, POINTER(c_int), c_int]),
+    'TemperatureControl_SetTemperatureLevel': (c_bool, [c_int, POINTER(c_int),
+                                                        c_int]),
+    'TemperatureControl_GetTemperature': (c_bool, [c_int, POINTER(c_int),
+                                                   POINTER(c_int), c_int]),
+    'PerformMeasurement_Blocking': (c_bool, [c_bool, c_bool, c_bool, c_bool,
+                                             c_int, POINTER(c_ushort),
+                                             POINTER(c_int), POINTER(c_int),
+                                             POINTER(c_int), c_int]),
+    'StartMeasurement': (c_bool, [c_bool, c_bool, c_bool, c_bool, c_int,
+                                  POINTER(c_int), c_int]),
+    'StopMeasurement': (c_bool, [c_int]),
+    'DllIsBusy': (c_bool, [c_int]),
+    'GetMeasurementData': (c_bool, [POINTER(c_ushort), POINTER(c_int),
+                                    POINTER(c_int), POINTER(c_int), c_int]),
+    'CloseCamera': (c_bool, [c_int, c_bool]),
+    }
+
+
+class GreatEyesSdk:
+    '''
+    greateyes.dll on Windows or the shared library of the Linux SDK
+    '''
+    def __init__(self, libPath=None):
+        if libPath is None:
+            libPath = 'greateyes.dll' if sys.platform == 'win32' \
+                                      else 'libgreateyes.so'
+        if sys.platform == 'win32':
+            from ctypes import WinDLL
+            self.lib = WinDLL(libPath)
+        else:
+            self.lib = CDLL(libPath)
+        self.functions = {}
+        for name, (restype, argtypes) in prototypes.items():
+            fun = getattr(self.lib, name, None) # missing in older versions
+            if fun is not None:
+                fun.restype = restype
+                fun.argtypes = argtypes
+            self.functions[name] = fun
+        # cameras are connected by address after ConnectToMultiCameraSystem
+        self.multiCamera = False
+
+    def hasFunction(self, name):
+        return self.functions.get(name) is not None
+
+    def __function(self, name):
+        if not self.hasFunction(name):
+            raise GreatEyesError(name, notSupported)
+        return self.functions[name]
+
+    def __call(self, name, *args, statusMsg=None):
+        if not self.__function(name)(*args):
+            raise GreatEyesError(name, -1 if statusMsg is None
+                                          else int(statusMsg.value))
+
+    def dllVersion(self):
+        size = c_int()
+        version = self.__function('GetDLLVersion')(byref(size))
+        return version[:size.value].decode(errors='replace')
+
+    def checkCamera(self):
+        '''
+        Returns status message code, raises if no camera is usable
+        '''
+        modelId = c_int()
+        model = POINTER(c_char)()
+        statusMsg = c_int()
+        self.__call('CheckCamera', byref(modelId), byref(model),
+                    byref(statusMsg), statusMsg=statusMsg)
+        return int(statusMsg.value)
+
+    def connectMultiCameraSystem(self):
+        '''
+        Returns number of connected cameras, addressed by 0..n-1
+        '''
+        numCameras = c_int()
+        self.__call('ConnectToMultiCameraSystem', byref(numCameras))
+        self.multiCamera = True
+        return numCameras.value
+
+    def connectCamera(self, addr=0):
+        '''
+        Connect one camera of a multi camera system, returns status code
+        '''
+        modelId = c_int()
+        model = POINTER(c_char)()
+        statusMsg = c_int()
+        self.__call('ConnectCamera', byref(modelId), byref(model),
+                    byref(statusMsg), addr, statusMsg=statusMsg)
+        return int(statusMsg.value)
+
+    def camSettings(self, readoutSpeed, exposureTime, binningX, binningY,
+                    addr=0):
+        '''
+        Returns number of pixels in x and y and pixel size
+        '''
+        numPixelInX = c_int()
+        numPixelInY = c_int()
+        pixelSize = c_int()
+        statusMsg = c_int()
+        self.__call('CamSettings', int(readoutSpeed), int(exposureTime),
+                    int(binningX), int(binningY), byref(numPixelInX),
+                    byref(numPixelInY), byref(pixelSize), byref(statusMsg),
+                    addr, statusMsg=statusMsg)
+        return numPixelInX.value, numPixelInY.value, pixelSize.value
+
+    def setupCropMode2D(self, columns, lines, addr=0):
+        self.__call('SetupCropMode2D', int(columns), int(lines), addr)
+
+    def activateCropMode(self, on, addr=0):
+        self.__call('ActivateCropMode', bool(on), addr)
+
+    def getImageSize(self, addr=0):
+        '''
+        Width, height and bytes per pixel of the frames
+        '''
+        width = c_int()
+        height = c_int()
+        bytesPerPixel = c_int()
+        self.__call('GetImageSize', byref(width), byref(height),
+                    byref(bytesPerPixel), addr)
+        return width.value, height.value, bytesPerPixel.value
+
+    def temperatureControlSetup(self, coolingOption, addr=0):
+        '''
+        Returns number of temperature levels
+        '''
+        statusMsg = c_int()
+        return self.__function('TemperatureControl_Setup')(
+                int(coolingOption), byref(statusMsg), addr)
+
+    def setTemperatureLevel(self, level, addr=0):
+        statusMsg = c_int()
+        self.__call('TemperatureControl_SetTemperatureLevel', int(level),
+                    byref(statusMsg), addr, statusMsg=statusMsg)
+
+    def getTemperature(self, sensor=0, addr=0):
+        temperature = c_int()
+        statusMsg = c_int()
+        self.__call('TemperatureControl_GetTemperature', int(sensor),
+                    byref(temperature), byref(statusMsg), addr,
+                    statusMsg=statusMsg)
+        return temperature.value
+
+    def performMeasurementBlocking(self, buffer, addr=0):
+        '''
+        Expose and read out into buffer (uint16 array, contiguous)
+        '''
+        writeBytes = c_int()
+        readBytes = c_int()
+        statusMsg = c_int()
+        self.__call('PerformMeasurement_Blocking', False, False, False, False,
+                    0, buffer.ctypes.data_as(POINTER(c_ushort)),
+                    byref(writeBytes), byref(readBytes), byref(statusMsg),
+                    addr, statusMsg=statusMsg)
+
+    def startMeasurement(self, addr=0):
+        statusMsg = c_int()
+        self.__call('StartMeasurement', False, False, False, False, 0,
+                    byref(statusMsg), addr, statusMsg=statusMsg)
+
+    def stopMeasurement(self, addr=0):
+        '''
+        Abort running exposure or readout
+        '''
+        self.__call('StopMeasurement', addr)
+
+    def isBusy(self, addr=0):
+        return bool(self.__function('DllIsBusy')(addr))
+
+    def getMeasurementData(self, buffer, addr=0):
+        writeBytes = c_int()
+        readBytes = c_int()
+        statusMsg = c_int()
+        self.__call('GetMeasurementData',
+                    buffer.ctypes.data_as(POINTER(c_ushort)),
+                    byref(writeBytes), byref(readBytes), byref(statusMsg),
+                    addr, statusMsg=statusMsg)
+
+    def closeCamera(self, addr=0):
+        self.__call('CloseCamera', addr, False)
+
+
+class SimulatedCamera:
+    '''
+    One simulated camera, frames are a noisy bias with a few spectral lines
+    and occasional cosmic rays, exposure and readout take the real time.
+    '''
+    sensorSize = (2048, 512) # x, y
+    readoutTimes = [0.05, 0.1, 0.2, 0.5, 1., 2.] # s, per readout speed
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.connected = False
+        self.settings = (0, 1000, 0, 0)
+        self.crop = (0, 0) # columns, lines
+        self.cropActive = False
+        self.temperature = 20.
+        self.setTemp = 20.
+        self.lastTempTime = time.monotonic()
+        self.readyTime = None # end of running measurement
+
+    def getImageSize(self):
+        readoutSpeed, exposureTime, binningX, binningY = self.settings
+        cols, lines = self.sensorSize
+        if self.cropActive:
+            cols = self.crop[0] or cols
+            lines = self.crop[1] or lines
+        nx = 1 if binningX >= 8 else max(1, cols // 2**binningX)
+        ny = max(1, lines // 2**binningY)
+        return nx, ny, 2
+
+    def camSettings(self, readoutSpeed, exposureTime, binningX, binningY):
+        if not 0 <= readoutSpeed < len(self.readoutTimes) or exposureTime < 0:
+            raise GreatEyesError('CamSettings', 8)
+        self.settings = (int(readoutSpeed), int(exposureTime), int(binningX),
+                         int(binningY))
+        nx, ny, bpp = self.getImageSize()
+        return nx, ny, 15
+
+    def setupCropMode2D(self, columns, lines):
+        self.crop = (int(columns), int(lines))
+
+    def activateCropMode(self, on):
+        self.cropActive = bool(on)
+
+    def temperatureControlSetup(self, coolingOption):
+        return 25
+
+    def setTemperatureLevel(self, level):
+        self.setTemp = 20. - 5*int(level)
+
+    def getTemperature(self, sensor=0):
+        # cools down with a time constant of 30 s
+        now = time.monotonic()
+        self.temperature += ((self.setTemp - self.temperature) *
+                             (1 - np.exp(-(now - self.lastTempTime)/30.)))
+        self.lastTempTime = now
+        return int(round(self.temperature + (15 if sensor else 0)))
+
+    def startMeasurement(self):
+        if self.isBusy():
+            raise GreatEyesError('StartMeasurement', 10)
+        readoutSpeed, exposureTime = self.settings[:2]
+        self.readyTime = (time.monotonic() + exposureTime*1e-3 +
+                          self.readoutTimes[readoutSpeed])
+
+    def stopMeasurement(self):
+        self.readyTime = None
+
+    def isBusy(self):
+        return self.readyTime is not None and time.monotonic() < self.readyTime
+
+    def __fillFrame(self, buffer):
+        nx, ny, bpp = self.getImageSize()
+        exposureTime = self.settings[1]*1e-3
+        frame = buffer.reshape(ny, nx)
+        x = np.arange(nx) / nx
+        spectrum = sum(a*np.exp(-0.5*((x - c)/w)**2) for a, c, w in
+                       ((3000, 0.3, 0.004), (1500, 0.55, 0.006),
+                        (800, 0.7, 0.003)))
+        profile = np.exp(-0.5*((np.arange(ny)/ny - 0.5)/0.1)**2)
+        signal = 500 + np.outer(profile, spectrum)*min(exposureTime, 10)
+        signal += self.rng.normal(0, 5, signal.shape)
+        # cosmic rays
+        n = self.rng.poisson(2)
+        signal[self.rng.integers(0, ny, n), self.rng.integers(0, nx, n)] += 5000
+        np.clip(signal, 0, 65535, out=signal)
+        frame[...] = signal
+
+    def performMeasurementBlocking(self, buffer):
+        self.startMeasurement()
+        while self.isBusy():
+            time.sleep(0.005)
+        self.getMeasurementData(buffer)
+
+    def getMeasurementData(self, buffer):
+        if self.readyTime is None:
+            raise GreatEyesError('GetMeasurementData', 9)
+        while self.isBusy():
+            time.sleep(0.005)
+        self.readyTime = None
+        self.__fillFrame(buffer)
+
+    def connectCamera(self):
+        self.connected = True
+        return 0
+
+    def closeCamera(self):
+        self.readyTime = None
+        self.connected = False
+
+
+class SimulatedSdk:
+    '''
+    Simulator with the interface of GreatEyesSdk for numCameras cameras,
+    calls are passed on to the camera at addr
+    '''
+    def __init__(self, numCameras=4, seed=None):
+        self.cameras = [SimulatedCamera(None if seed is None else seed + i)
+                        for i in range(numCameras)]
+        self.multiCamera = False
+
+    def hasFunction(self, name):
+        return name in prototypes
+
+    def dllVersion(self):
+        return 'simulator'
+
+    def checkCamera(self):
+        return self.cameras[0].connectCamera()
+
+    def connectMultiCameraSystem(self):
+        self.multiCamera = True
+        return len(self.cameras)
+
+    def __getattr__(self, name):
+        def call(*args, addr=0):
+            if not 0 <= addr < len(self.cameras):
+                raise GreatEyesError(name, 1)
+            return getattr(self.cameras[addr], name)(*args)
+        return call
+
+
+def loadSdk(backend=None):
+    '''
+    Backend is 'simulator' or the path of the SDK library, default from
+    environment variable GREATEYES_BACKEND or the library of the platform
+    '''
+    backend = backend or os.environ.get('GREATEYES_BACKEND')
+    if backend == 'simulator':
+        return SimulatedSdk()
+    return GreatEyesSdk(backend)
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio client for Gentec Maestro power meters streaming over TCP
+
+Every meter sends one value per line after 'start\\n' until 'stop\\n'.
+All meters are handled by one event loop in its own thread. Received data
+is parsed per read in one step and handed over as arrays (time stamps in
+ns since epoch, values).
+"""
+
+import asyncio
+import threading
+import numpy as np
+
+from Helpers.timebase import timeBase
+
+
+def parseLines(block):
+    '''
+    Values of a block of complete lines (bytes) in one step, lines which
+    are no number are dropped
+    '''
+    try:
+        return np.array(block.split(), dtype=np.float64)
+    except ValueError:
+        # rare, e.g. an error message of the meter
+        values = []
+        for line in block.split():
+            try:
+                values.append(float(line))
+            except ValueError:
+                print('Maestro:', line.decode(errors='replace'))
+        return np.array(values, dtype=np.float64)
+
+
+class Meter:
+    '''
+    State of one meter, only used in the thread of the event loop
+    '''
+    def __init__(self, name, host, port):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.streaming = False # should be streaming, also after reconnect
+        self.writer = None
+        self.task = None
+        self.partialLine = b'' # incomplete line of last read
+        self.lastTime = None # time stamp of last batch
+        self.pending = [] # batches (times, values) not handed over yet
+        self.numPending = 0
+        self.inFlight = False # batch handed over, not acknowledged yet
+        self.dropped = 0
+
+
+class MaestroClient:
+    '''
+    Connects, starts and stops any number of meters and reconnects with
+    increasing delay if a connection fails or is lost.
+    onBatch(name, times, values) is called in the thread of the event loop.
+    Only one batch per meter is in flight until the consumer calls
+    ack(name), data arriving meanwhile is collected and handed over as one
+    bigger batch. If the consumer falls behind by more than maxPending
+    samples, the oldest samples are dropped and counted.
+    '''
+    def __init__(self, onBatch, onState=lambda name, state: None,
+                 maxPending=1000000, reconnectDelay=(0.5, 10.)):
+        self.onBatch = onBatch
+        self.onState = onState
+        self.maxPending = maxPending
+        self.reconnectDelay = reconnectDelay # first and maximal delay in s
+        self.meters = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       name='maestro', daemon=True)
+        self.thread.start()
+
+    #------ thread safe interface
+    def addMeter(self, name, host, port):
+        self.loop.call_soon_threadsafe(self.__addMeter, name, host, int(port))
+
+    def removeMeter(self, name):
+        self.loop.call_soon_threadsafe(self.__removeMeter, name)
+
+    def start(self, name):
+        self.loop.call_soon_threadsafe(self.__setStreaming, name, True)
+
+    def stop(self, name):
+        self.loop.call_soon_threadsafe(self.__setStreaming, name, False)
+
+    def ack(self, name):
+        '''
+        Consumer is ready for the next batch of meter name
+        '''
+        self.loop.call_soon_threadsafe(self.__ack, name)
+
+    def dropped(self, name):
+        meter = self.meters.get(name)
+        return 0 if meter is None else meter.dropped
+
+    def close(self):
+        '''
+        Stop all meters, close connections and the event loop
+        '''
+        future = asyncio.run_coroutine_threadsafe(self.__closeAll(), self.loop)
+        future.result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+    #------ run in thread of event loop
+    def __addMeter(self, name, host, port):
+        if name in self.meters:
+            self.__removeMeter(name)
+        meter = Meter(name, host, port)
+        self.meters[name] = meter
+        meter.task = self.loop.create_task(self.__runMeter(meter))
+
+    def __removeMeter(self, name):
+        meter = self.meters.pop(name, None)
+        if meter is not None:
+            self.__send(meter, b'stop\n')
+            meter.task.cancel()
+
+    def __setStreaming(self, name, streaming):
+        meter = self.meters.get(name)
+        if meter is None:
+            return
+        meter.streaming = streaming
+        meter.lastTime = None
+        self.__send(meter, b'start\n' if streaming else b'stop\n')
+
+    def __send(self, meter, command):
+        if meter.writer is not None:
+            meter.writer.write(command)
+
+    async def __closeAll(self):
+        for name in list(self.meters):
+            self.__removeMeter(name)
+        await asyncio.sleep(0.1) # let the cancelled tasks close sockets
+
+    async def __runMeter(self, meter):
+        delay = self.reconnectDelay[0]
+        while True:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(meter.host, meter.port), 5)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.onState(meter.name, 'connection failed: ' + str(e))
+                await asyncio.sleep(delay)
+                delay = min(2*delay, self.reconnectDelay[1])
+                continue
+            delay = self.reconnectDelay[0]
+            meter.writer = writer
+            meter.partialLine = b''
+            meter.lastTime = None
+            self.onState(meter.name, 'connected')
+            if meter.streaming:
+                writer.write(b'start\n')
+            try:
+                while True:
+                    data = await reader.read(65536)
+                    if not data:
+                        break
+                    self.__received(meter, data)
+            except OSError:
+                pass
+            finally:
+                meter.writer = None
+                writer.close()
+            self.onState(meter.name, 'disconnected')
+            await asyncio.sleep(delay)
+
+    def __received(self, meter, data):
+        data = meter.partialLine + data
+        end = data.rfind(b'\n') + 1
+        meter.partialLine = data[end:]
+        if end == 0:
+            return
+        values = parseLines(data[:end])
+        n = len(values)
+        if not n:
+            return
+        # samples of a read arrived since the last read, spread them,
+        # but not over a longer break of the stream
+        now = timeBase.nanoseconds()
+        last = meter.lastTime or now
+        if now - last > 1e9:
+            last = now
+        meter.lastTime = now
+        times = last + np.arange(1, n+1, dtype=np.int64)*(now - last)//n
+        meter.pending.append((times, values))
+        meter.numPending += n
+        while meter.numPending > self.maxPending and len(meter.pending) > 1:
+            dropped = len(meter.pending.pop(0)[1])
+            meter.numPending -= dropped
+            meter.dropped += dropped
+        if not meter.inFlight:
+            self.__deliver(meter)
+
+    def __deliver(self, meter):
+        if not meter.pending:
+            return
+        times = np.concatenate([b[0] for b in meter.pending])
+        values = np.concatenate([b[1] for b in meter.pending])
+        meter.pending = []
+        meter.numPending = 0
+        meter.inFlight = True
+        self.onBatch(meter.name, times, values)
+
+    def __ack(self, name):
+        meter = self.meters.get(name)
+        if meter is None:
+            return
+        meter.inFlight = False
+        self.__deliver(meter)
@@ -5,13 +5,13 @@
 from guidata.qt.QtGui import (QSplitter, QGridLayout, QLineEdit,
                               QIntValidator, QDoubleValidator, QWidget, QPushButton,
                               QLabel, QMessageBox, QSlider, QFrame, QSizePolicy)
-from guidata.qt.QtCore import (QThread, Qt, Signal)
+from guidata.qt.QtCore import (Qt, Signal)
 
 import numpy as np
 import time
 
 from pipython import GCSDevice, pitools
-from Helpers.genericthread import GenericWorker
+from Helpers.scheduler import Scheduler
 
 from scipy.constants import c
 nAir = 1.000292
@@ -128,19 +128,9 @@ class PiStageUi(QSplitter):
             lambda x=-1: self.moveRel_mm(float(self.deltaMove_mm.text()), x))
         
         ################
-        # thread for updating position
-        #self.currPosThr = GenericThread(self.__getCurrPos)
+        # task for updating position
         self.updateCurrPos.connect(self.__updateCurrPos)
-        self.currPos_thread = QThread() # create the QThread
-        self.currPos_thread.start()
-
-        # This causes my_worker.run() to eventually execute in my_thread:
-        self.currPos_worker = GenericWorker(self.__getCurrPos)
-        self.currPos_worker.moveToThread(self.currPos_thread)
-        # my_worker.finished.connect(self.xxx)
-
-        #self.threadPool.append(my_thread)
-        #self.my_worker = my_worker
+        self.scheduler = Scheduler()
         
 
     def connectStage(self):
@@ -189,18 +179,25 @@ class PiStageUi(QSplitter):
             msg.setText('No stage connected')
             msg.exec_()
 
-    def gotoPos_mm(self, x):
-        '''Move stage to absolute position in mm'''
+    def gotoPos_mm(self, x, token=None):
+        '''Move stage to absolute position in mm and wait until it is there.
+           If token gets cancelled meanwhile the stage is halted and False
+           returned'''
         if self.stageRange[0] <= x <= self.stageRange[1]:
             self.stage.MOV(self.stage.axes, x)
             while not pitools.ontarget(self.stage, '1')['1']:
-                time.sleep(0.05)
+                if token is None:
+                    time.sleep(0.05)
+                elif token.wait(0.05):
+                    self.stage.HLT(self.stage.axes)
+                    return False
         else:
             print('Requested postition', x, 'outside of range', self.stageRange)
+        return True
 
-    def gotoPos_fs(self, x):
-        '''Move stage to absolute position in mm'''
-        self.gotoPos_mm(self._calcAbsPos(x))
+    def gotoPos_fs(self, x, token=None):
+        '''Move stage to absolute position in fs'''
+        return self.gotoPos_mm(self._calcAbsPos(x), token)
 
     def moveRel_mm(self, x=0, sign=1):
         '''Moves stage relative to current position'''
@@ -256,24 +253,23 @@ class PiStageUi(QSplitter):
         self.offset = self.stage.qPOS()['1']
 
     def __startCurrPosThr(self):
-        self.stopCurrPosThr = False
-        #self.currPosThr.start()
-        self.currPos_worker.start.emit()
+        self.scheduler.submit(self.__getCurrPos, lane='currPos',
+                              cancelRunning=True)
     def __stopCurrPosThr(self):
-        self.stopCurrPosThr = True
-        while(self.currPosThr.isRunning()):
-            time.sleep(0.03)
-    def __getCurrPos(self):
+        self.scheduler.cancel('currPos')
+    def __getCurrPos(self, token):
         oldPos = self.stage.qPOS()['1']
-        while not self.stopCurrPosThr:
+        while not token.wait(0.5):
             newPos = self.stage.qPOS()['1']
             if oldPos != newPos:
                 oldPos = newPos
                 self.updateCurrPos.emit(newPos)
-            time.sleep(0.5)
             
     def __updateCurrPos(self, newPos):
         self.currentPos.setText('{:.7f}'.format(newPos))
+
+    def closeEvent(self, event):
+        self.scheduler.close()
         
 if __name__ == '__main__':
     from guidata.qt.QtGui import QApplication
@@ -173,8 +173,9 @@ class TiePieUi(QSplitter):
             msg.setText('No supported device found')
             msg.exec_()
 
-    def getData(self):
-        # function called thread for updating plot
+    def getData(self, token=None):
+        # function called thread for updating plot, returns None if token
+        # got cancelled while waiting for a trigger
         avg = int(self.averages.text())
         with QMutexLocker(self.mutex):
             x = np.linspace(0,
@@ -184,7 +185,10 @@ class TiePieUi(QSplitter):
             for i in range(avg):
                 self.scp.start()
                 while not self.scp.is_data_ready:
-                    time.sleep(0.01)
+                    if token is None:
+                        time.sleep(0.01)
+                    elif token.wait(0.01):
+                        return None
                 y[i,:] = self.scp.get_data()[self.measCh.currentIndex()]
         return np.column_stack((x, y.mean(axis=0)))
 
@@ -12,7 +12,7 @@ from guidata.qt.QtGui import (QMainWindow, QMessageBox,
                               QSpinBox, QHBoxLayout,
                               QVBoxLayout, QGridLayout,  
                               QTabWidget, QLabel, QLineEdit,  
-                              QFont, QIcon)
+                              QFont, QIcon, QWidget)
 from guidata.qt.QtCore import (Qt, Signal, QThread, QLocale)
 from guidata.qt import PYQT5
 #from guidata.qt.compat import getopenfilenames, getsavefilename
@@ -24,6 +24,7 @@ import os.path as osp
 import os
 import numpy as np
 import time
+import datetime
 
 #from guidata.dataset.datatypes import DataSet, ValueProp
 #from guidata.dataset.dataitems import (IntItem, FloatArrayItem, StringItem,
@@ -40,9 +41,12 @@ from guiqwt.plot import CurveWidget
 from guiqwt.config import _
 
 # local imports
-from Helpers.plotSignal import SignalFT, DockablePlotWidget
+from Helpers.plotSignal import TraceFT, SignalFT, DockablePlotWidget
+from Helpers.pyramid import MinMaxPyramid
+from Helpers.streamstats import StreamStats
 from Helpers.genericthread import GenericWorker
 from Helpers.fileui import FileUi
+from Helpers.logwriter import LogWriter
 from Instruments.gentec import MaestroUi
 
 # set default language to c, so decimal point is '.' not ',' on german systems
@@ -111,6 +115,12 @@ class MainWindow(QMainWindow):
     updateOsciPlot = Signal(object)
     updateTdPlot = Signal(object)
     updateFdPlot = Signal(object)
+    # layout of the power dataset in HDF5 files
+    powerDtype = np.dtype([('time', np.int64),
+                           ('seconds', np.float64),
+                           ('power', np.float64)])
+    powerAttrs = {'device': 'Gentec Maestro', 'device_serial': '1234',
+                  'time_unit': 'ns since epoch (UTC)'}
     def __init__(self):
         QMainWindow.__init__(self)
 
@@ -132,7 +142,29 @@ class MainWindow(QMainWindow):
         self.curveWidget1.calcFun.addFun('hour', lambda x: x/3600,
                                                   lambda x: x*3600)
         plot1 = self.curveWidget1.get_plot()
-        self.signal1 = SignalFT(self, plot=plot1)
+
+        ###############
+        # rolling statistics and Allan deviation of the log
+        self.stats = StreamStats()
+        self.statsShown = 0 # monotonic time of last display update
+        self.allanWidget = DockablePlotWidget(self, CurveWidget,
+                                              curveplot_toolbar)
+        allanPlot = self.allanWidget.get_plot()
+        allanPlot.set_axis_scale('bottom', 'log')
+        allanPlot.set_axis_scale('left', 'log')
+        allanPlot.set_axis_title('bottom', 'tau (s)')
+        allanPlot.set_axis_title('left', 'Allan deviation (W)')
+        self.allanSignal = SignalFT(self, plot=allanPlot)
+
+        ###############
+        # histogram of pulse energies
+        self.histShown = 0 # monotonic time of last display update
+        self.histWidget = DockablePlotWidget(self, CurveWidget,
+                                             curveplot_toolbar)
+        histPlot = self.histWidget.get_plot()
+        histPlot.set_axis_title('bottom', 'energy (J)')
+        histPlot.set_axis_title('left', 'shots')
+        self.histSignal = SignalFT(self, plot=histPlot)
         
 
         ##############
@@ -144,17 +176,40 @@ class MainWindow(QMainWindow):
         self.tabwidget.addTab(self.maestroUi, QIcon('icons/Handyscope_HS4.png'),
                               _("Maestro"))
         self.tabwidget.addTab(self.fileUi, get_icon('filesave.png'), _('File'))
+        self.tabwidget.addTab(self.__makeStatsWidget(), _('Statistics'))
+        # min/max levels of the log, so hours of data stay interactive
+        self.pyramid = MinMaxPyramid(self.maestroUi.measureData,
+                                     'seconds', 'power')
+        self.signal1 = TraceFT(self, plot1, self.pyramid)
         self.add_dockwidget(self.tabwidget, _("Inst. sett."))
 #        self.setCentralWidget(self.tabwidget)
         self.dock1 = self.add_dockwidget(self.curveWidget1,
                                               title=_("Powermeter"))
+        self.dock2 = self.add_dockwidget(self.allanWidget,
+                                              title=_("Allan deviation"))
+        self.dock3 = self.add_dockwidget(self.histWidget,
+                                              title=_("Energy histogram"))
 
         ################
         # connect signals
-        self.maestroUi.newPlotData.connect(self.signal1.updatePlot)
+        self.maestroUi.newPlotData.connect(self.updatePlot)
+        self.maestroUi.newBatch.connect(self.updateHistogram)
+        self.maestroUi.histResetBtn.released.connect(self.updateHistogram)
+        self.maestroUi.startMeasBtn.released.connect(self.pyramid.clear)
+        self.maestroUi.startMeasBtn.released.connect(self.stats.clear)
         self.curveWidget1.calcFun.idxChanged.connect(self.signal1.funChanged)
         self.fileUi.saveTxtBtn.released.connect(self.saveDataTxt)
         self.fileUi.saveHdfBtn.released.connect(self.saveDataHDF5)
+        self.fileUi.saveHdfCheck.stateChanged.connect(self.streamChanged)
+        self.fileUi.flushSpin.valueChanged.connect(
+            lambda s: self.logWriter.setFlushIntervall(s))
+
+        ################
+        # thread streaming the log to file
+        self.status = self.statusBar()
+        self.logWriter = LogWriter(self.fileUi.flushSpin.value())
+        self.logWriter.message.connect(self.updateStatus)
+        self.streamed = 0 # rows of log written to stream file
         '''
         self.piUi.startScanBtn.released.connect(self.startMeasureThr)
         self.piUi.stopScanBtn.released.connect(self.stopMeasureThr)
@@ -242,12 +297,134 @@ class MainWindow(QMainWindow):
         self.addDockWidget(location, dockwidget)
         return dockwidget
         
+    def __makeStatsWidget(self):
+        '''
+        Table of labels, one row per window of the rolling statistics
+        '''
+        widget = QWidget()
+        layout = QGridLayout()
+        widget.setLayout(layout)
+        header = ['window', 'mean (W)', 'std (W)', 'min (W)', 'max (W)',
+                  'rms noise (%)']
+        for col, text in enumerate(header):
+            layout.addWidget(QLabel(text), 0, col)
+        self.statsLabels = []
+        for row, window in enumerate(self.stats.windows):
+            layout.addWidget(QLabel(str(window)), row+1, 0)
+            labels = [QLabel('-') for i in range(len(header)-1)]
+            for col, label in enumerate(labels):
+                layout.addWidget(label, row+1, col+1)
+            self.statsLabels.append(labels)
+        self.quantileLabel = QLabel('')
+        layout.addWidget(self.quantileLabel, len(self.stats.windows)+1, 0,
+                         1, len(header))
+        layout.setRowStretch(len(self.stats.windows)+2, 10)
+        return widget
+
+    def updateStats(self):
+        '''
+        Show statistics and Allan deviation, write them to the stream file
+        '''
+        rolling = self.stats.rolling()
+        for labels, row in zip(self.statsLabels, rolling):
+            values = [row['mean'], row['std'], row['min'], row['max'],
+                      100*row['rms_noise']]
+            for label, value in zip(labels, values):
+                label.setText('{:.4g}'.format(value))
+        allan = self.stats.allan()
+        allan = allan[allan['terms'] > 0]
+        self.allanSignal.curve.set_data(allan['tau'], allan['adev'])
+        self.allanWidget.get_plot().do_autoscale()
+        if self.fileUi.saveHdfCheck.isChecked():
+            self.logWriter.updateDatasets(self.sessionDatasets())
+
+    def updateHistogram(self, *args):
+        '''
+        Show histogram and quantiles of the energies, at most twice per s
+        '''
+        if args and time.monotonic() - self.histShown < 0.5:
+            return
+        self.histShown = time.monotonic()
+        histogram = self.maestroUi.histogram
+        self.histSignal.curve.set_data(*histogram.steps())
+        self.histWidget.get_plot().do_autoscale()
+        quantiles = histogram.quantiles
+        self.quantileLabel.setText('{:d} shots, quantiles: '.format(
+            histogram.count) + ', '.join('{:g}%: {:.4g}'.format(100*q, v)
+            for q, v in zip(quantiles.quantiles, quantiles.values())))
+
+    def sessionDatasets(self):
+        '''
+        Statistics and histogram saved with the log
+        '''
+        datasets = self.stats.datasets()
+        datasets.update(self.maestroUi.histogram.datasets())
+        return datasets
+
     def closeEvent(self, event):
         self.maestroUi.closeEvent(event)
+        if self.fileUi.saveHdfCheck.isChecked():
+            self.logWriter.updateDatasets(self.sessionDatasets(), block=True)
+        self.logWriter.close()
         if self.console is not None:
             self.console.exit_interpreter()
         event.accept()
 
+    def updateStatus(self, msg):
+        self.status.showMessage(msg, 10000)
+
+    def updatePlot(self, tail):
+        '''
+        New samples arrived, only they are added to the pyramid and the
+        statistics and streamed to file
+        '''
+        self.signal1.updateTrace(tail)
+        self.stats.add(tail['time'], tail['power'])
+        if time.monotonic() - self.statsShown > 0.5:
+            self.statsShown = time.monotonic()
+            self.updateStats()
+        if self.fileUi.saveHdfCheck.isChecked():
+            self.__streamRows()
+
+    def __streamRows(self):
+        log = self.maestroUi.measureData
+        if len(log) < self.streamed: # new measurement started
+            self.streamed = 0
+        start, self.streamed = self.streamed, len(log)
+        self.logWriter.addRows(self.powerRows(start, self.streamed))
+
+    def streamChanged(self, state):
+        '''
+        Stream log to one file per session while 'Save HDF5' is checked
+        '''
+        if state == 2:
+            self.logWriter.openSession(
+                'data/{:s}_Power.h5'.format(self.fileUi.fileName), 'power',
+                self.powerDtype, self.fileAttrs(), self.powerAttrs,
+                self.sessionDatasets())
+            # rows logged before streaming was switched on
+            self.streamed = 0
+            self.__streamRows()
+        else:
+            self.logWriter.updateDatasets(self.sessionDatasets(), block=True)
+            self.logWriter.closeSession()
+
+    def fileAttrs(self):
+        return {'comments': self.fileUi.comment.toPlainText(),
+                'detector': '', 'detector_settings': ''}
+
+    def powerRows(self, start=0, stop=None):
+        '''
+        Rows of the log as structured array
+        '''
+        log = self.maestroUi.measureData
+        seconds = log.column('seconds', start, stop)
+        data = np.zeros(len(seconds), dtype=self.powerDtype)
+        data['time'] = log.column('time', start, start+len(data))
+        data['seconds'] = seconds
+        data['power'] = log.column('power', start, start+len(data))
+        return data
+
     def saveDataTxt(self):
         import datetime
         now = datetime.datetime.now().strftime('%Y%m%d-%H%M%S_Maestro')
@@ -287,29 +464,24 @@ class MainWindow(QMainWindow):
         msg.exec_()
                
     def saveDataHDF5(self):
-        import datetime
+        '''
+        Snapshot of the whole log and PNG of the plot
+        '''
         import h5py
 
-        fileName = self.fileUi.fileName
-        print(fileName)
-        if fileName is None:
-            now = datetime.datetime.now().strftime('%Y%m%d-%H%M%S_Power')
-        else:
-            now = fileName + '_Power'
+        now = datetime.datetime.now().strftime('%Y%m%d-%H%M%S_Power')
         with h5py.File('data/{:s}.h5'.format(now), 'w') as f:
-            f.attrs['comments'] = self.fileUi.comment.toPlainText()
-            f.attrs['detector'] = ''
-            f.attrs['detector_settings'] = ''
+            for key, value in self.fileAttrs().items():
+                f.attrs[key] = value
 
             # save powermeter data
-            dt = np.dtype([('iso_time', 'S26'), 
-                   ('seconds', np.float),
-                   ('power', np.float)])
-            data = np.asarray(self.maestroUi.measureData, dtype=dt)
-            dset = f.create_dataset('power', data=data)
-            dset.attrs['device'] = 'Gentec Maestro'
-            dset.attrs['device_serial'] = '1234'
-            self.signal1.plot.save_widget('data/{:s}.png'.format(now))    
+            dset = f.create_dataset('power', data=self.powerRows())
+            for key, value in self.powerAttrs.items():
+                dset.attrs[key] = value
+            for key, value in self.sessionDatasets().items():
+                f.create_dataset(key, data=value)
+        self.signal1.plot.save_widget('data/{:s}.png'.format(now))
+        self.updateStatus('data/{:s}.h5 saved'.format(now))
 
         # TODO: maybe put this in status bar
         '''